@@ -0,0 +1,271 @@
+"""Benchmark of the matching and code-generation pipeline.
+
+Measures the per-line latency and throughput of ``preprocess_text``,
+``match_to_function``, ``match_many``, ``emit_function_code``,
+``convert_action_to_function`` and ``convert`` on synthetic procedures. The LLM is replaced by the
+deterministic ``StubClient`` with a configurable latency. It also reports
+the peak Python memory of each stage and the top-1 matching accuracy on
+``labeled_actions.jsonl``, so a speed-up that breaks matching shows up in
+the same report.
+
+    python benchmarks/bench_pipeline.py --sizes 10 100 1000 --output bench.json
+    python benchmarks/bench_pipeline.py --compare bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_client import StubClient  # noqa: E402
+
+LABELED_ACTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "labeled_actions.jsonl")
+STAGES = ["preprocess_text", "match_to_function", "match_many", "emit_function_code", "convert_action_to_function", "convert"]
+
+TEMPLATES = [
+    "Prime pump {n} with {volume} mL using chemspd as manager.",
+    "Transfer {volume} mL of {chemical} (liquid) from {source} to {destination} with needle {n}.",
+    "Transfer {weight} mg of {chemical} (solid) from {source} to {destination}.",
+    "Perform Schlenk cycles on {destination} with {seconds} sec evacuation and {seconds} sec backfill_time.",
+    "Reflux {destination} at {rpm} rpm, {temperature} C, heat and cool {n} hour and condenser temperature at 20 C.",
+    "Filter {volume} mL liquid sourced from {source}. Use filter_cartridge as filtration rack.",
+]
+CHEMICALS = ["THF", "water", "solvent", "toluene", "halide", "base", "boronic acid", "catalyst solution"]
+ZONES = ["thf", "water", "solvent", "rxn_well", "internal_standard", "bmida", "halide", "base", "vial_1", "vial_2"]
+
+
+class NullEmitter:
+    """Socket.IO stand-in recording when each generated line is emitted."""
+
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data=None, **kwargs):
+        if event == "correct_structured":
+            self.emitted.append(time.perf_counter())
+
+
+def synthetic_procedure(lines, seed=0):
+    rng = random.Random(seed)
+    procedure = []
+    for _ in range(lines):
+        procedure.append(rng.choice(TEMPLATES).format(
+            n=rng.randint(1, 4),
+            volume=rng.choice(["0.1", "1.0", "3", "10"]),
+            weight=rng.choice(["0.1", "5", "20"]),
+            seconds=rng.choice([30, 60, 120]),
+            rpm=rng.choice([100, 300, 500]),
+            temperature=rng.choice([60, 80, 100]),
+            chemical=rng.choice(CHEMICALS),
+            source=rng.choice(ZONES),
+            destination=rng.choice(ZONES),
+        ))
+    return procedure
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def percentile_ms(latencies, q):
+    value = percentile(latencies, q)
+    return None if value is None else value * 1000
+
+
+def column(value, width, precision):
+    """``value`` formatted for the results table, ``-`` if it is missing."""
+    return f"{'-' if value is None else f'{value:.{precision}f}':>{width}}"
+
+
+def summarize(stage, lines, total, latencies, llm_requests, peak_memory):
+    # Latencies are empty when no line produced a timing, e.g. for an empty procedure
+    return {
+        "stage": stage,
+        "lines": lines,
+        "total_s": total,
+        "throughput_lines_per_s": lines / total if total else None,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+        "llm_requests": llm_requests,
+        "peak_memory_mb": peak_memory,
+    }
+
+
+def run_stage(stage, procedure, args):
+    """Run ``stage`` over ``procedure`` and return (total seconds, per-line latencies, LLM requests)."""
+    # The pipeline prints debug output for every action
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return _run_stage(stage, procedure, args)
+
+
+def _run_stage(stage, procedure, args):
+    from function_registry import get_registry
+    from generate_chatgpt_func_call import convert, convert_action_to_function, emit_function_code
+    from match_function import match_many, match_to_function, preprocess_text
+
+    functions = get_registry().functions
+
+    client = StubClient(latency=args.llm_latency)
+    if stage == "emit_function_code":
+        # Calls as the model returns them, with numbers as strings
+        calls = []
+        for line, candidates in zip(procedure, match_many(procedure, functions, top_k=1)):
+            function = next(func for func in functions if func["name"] == candidates[0][0])
+            arguments = client._placeholder_arguments(function)
+            calls.append((function["name"], {name: str(value) for name, value in arguments.items()}))
+    latencies = []
+    start = time.perf_counter()
+    if stage == "preprocess_text":
+        for line in procedure:
+            line_start = time.perf_counter()
+            preprocess_text(line)
+            latencies.append(time.perf_counter() - line_start)
+    elif stage == "match_to_function":
+        for line in procedure:
+            line_start = time.perf_counter()
+            match_to_function(line, functions)
+            latencies.append(time.perf_counter() - line_start)
+    elif stage == "match_many":
+        match_many(procedure, functions)
+        if procedure:
+            latencies = [(time.perf_counter() - start) / len(procedure)] * len(procedure)
+    elif stage == "emit_function_code":
+        for name, arguments in calls:
+            line_start = time.perf_counter()
+            emit_function_code(functions, name, arguments)
+            latencies.append(time.perf_counter() - line_start)
+    elif stage == "convert_action_to_function":
+        emitter = NullEmitter()
+        for line in procedure:
+            line_start = time.perf_counter()
+            convert_action_to_function(line, functions, emitter, client=client, fast_path=args.fast_path)
+            latencies.append(time.perf_counter() - line_start)
+    elif stage == "convert":
+        # Latency of a line is the time until its code is emitted
+        emitter = NullEmitter()
+        convert("\n".join(procedure), emitter, concurrency=args.concurrency, client=client,
+                fast_path=args.fast_path, stream=args.stream, batch_size=args.batch_size)
+        latencies = [emitted - start for emitted in emitter.emitted]
+    return time.perf_counter() - start, latencies, client.calls
+
+
+def peak_memory(stage, procedure, args):
+    """Peak Python memory (in MB) allocated while running ``stage``."""
+    tracemalloc.start()
+    try:
+        run_stage(stage, procedure, args)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def matching_accuracy(path=LABELED_ACTIONS):
+    """Top-1 accuracy of ``match_many`` on the labeled actions."""
+    from function_registry import get_registry
+    from match_function import match_many
+
+    functions = get_registry().functions
+    with open(path) as f:
+        labeled = [json.loads(line) for line in f if line.strip()]
+    matches = match_many([row["action"] for row in labeled], functions, top_k=1)
+    errors = [
+        {"action": row["action"], "expected": row["function"], "matched": candidates[0][0]}
+        for row, candidates in zip(labeled, matches)
+        if candidates[0][0] != row["function"]
+    ]
+    return {"top1": 1 - len(errors) / len(labeled), "n": len(labeled), "errors": errors}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Print the change of every stage against a previous report."""
+    previous = {(row["stage"], row["lines"]): row for row in baseline["results"]}
+    print(f"\nCompared to {baseline['meta'].get('commit')}:")
+    for row in report["results"]:
+        old = previous.get((row["stage"], row["lines"]))
+        if old is None or not old["p50_ms"] or not old["throughput_lines_per_s"]:
+            continue
+        print(f"{row['stage']:>28} {row['lines']:>6} lines: "
+              f"p50 x{row['p50_ms'] / old['p50_ms']:.2f}, "
+              f"throughput x{row['throughput_lines_per_s'] / old['throughput_lines_per_s']:.2f}")
+    print(f"{'top-1 accuracy':>28}: {baseline['accuracy']['top1']:.3f} -> {report['accuracy']['top1']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="latency of the stub LLM in seconds")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="benchmark the streaming pipeline of convert")
+    parser.add_argument("--batch-size", type=int, default=1, help="actions per LLM request in convert")
+    parser.add_argument("--no-fast-path", dest="fast_path", action="store_false",
+                        help="send every action to the (stub) LLM")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak memory pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    args = parser.parse_args()
+
+    from match_function import warm_up
+
+    # Keep the model load and the index build out of the measurements
+    warm_up(background=False)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "results": [],
+    }
+    print(f"{'stage':>28} {'lines':>6} {'lines/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'LLM req':>8} {'peak MB':>8}")
+    for lines in args.sizes:
+        procedure = synthetic_procedure(lines, args.seed)
+        for stage in args.stages:
+            total, latencies, llm_requests = run_stage(stage, procedure, args)
+            memory = peak_memory(stage, procedure, args) if args.memory else None
+            row = summarize(stage, lines, total, latencies, llm_requests, memory)
+            report["results"].append(row)
+            print(f"{stage:>28} {lines:>6} {column(row['throughput_lines_per_s'], 10, 1)} {column(row['p50_ms'], 9, 3)} "
+                  f"{column(row['p95_ms'], 9, 3)} {column(row['p99_ms'], 9, 3)} {llm_requests:>8} {column(memory, 8, 1)}")
+
+    report["accuracy"] = matching_accuracy()
+    print(f"top-1 matching accuracy: {report['accuracy']['top1']:.3f} on {report['accuracy']['n']} labeled actions")
+    for error in report["accuracy"]["errors"]:
+        print(f"    {error['action']!r}: expected {error['expected']}, matched {error['matched']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
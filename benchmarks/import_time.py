@@ -0,0 +1,97 @@
+"""Import-time report for the translation modules.
+
+Runs ``python -X importtime`` in a fresh interpreter for each module, and
+reports the cumulative import time and the heaviest imports. It also
+reports the cold latency of the first match, which includes loading the
+spaCy model and building the TF-IDF index.
+
+    python benchmarks/import_time.py --budget-ms 1500 --output import_time.json
+
+Exits with status 1 if a module exceeds ``--budget-ms``, so the script
+can guard against import-time regressions.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["match_function", "rule_extractor", "response_cache", "generate_chatgpt_func_call"]
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+FIRST_MATCH = """
+import time
+start = time.perf_counter()
+from match_function import functions, match_to_function
+imported = time.perf_counter()
+match_to_function("Transfer 1.0 mL of solvent from solvent to rxn_well with needle 1.", functions)
+matched = time.perf_counter()
+print((imported - start) * 1000, (matched - imported) * 1000)
+"""
+
+
+def import_times(module):
+    """Cumulative import time of ``module`` and its heaviest dependencies, in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            imports.append((match.group(4), int(match.group(2)) / 1000, len(match.group(3)) // 2))
+    position = next(i for i, (name, _, _) in enumerate(imports) if name == module)
+    total, depth = imports[position][1], imports[position][2]
+    # Nested imports are listed before their parent; keep the direct ones only
+    heaviest = []
+    for name, cumulative, child_depth in reversed(imports[:position]):
+        if child_depth <= depth:
+            break
+        if child_depth == depth + 1:
+            heaviest.append((name, cumulative))
+    heaviest.sort(key=lambda item: -item[1])
+    return total, heaviest
+
+
+def first_match_time():
+    """Import and cold first-match latency of the matcher, in ms."""
+    result = subprocess.run([sys.executable, "-c", FIRST_MATCH], cwd=ROOT, capture_output=True, text=True, check=True)
+    imported, matched = result.stdout.split()
+    return float(imported), float(matched)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--top", type=int, default=5, help="number of heaviest imports listed per module")
+    parser.add_argument("--budget-ms", type=float, help="fail if a module takes longer to import")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    report = {"modules": {}}
+    over_budget = []
+    for module in args.modules:
+        total, heaviest = import_times(module)
+        report["modules"][module] = {"import_ms": total, "heaviest": dict(heaviest[:args.top])}
+        print(f"{module}: {total:.1f} ms")
+        for name, cumulative in heaviest[:args.top]:
+            print(f"    {name}: {cumulative:.1f} ms")
+        if args.budget_ms is not None and total > args.budget_ms:
+            over_budget.append(module)
+
+    imported, matched = first_match_time()
+    report["first_match"] = {"import_ms": imported, "first_match_ms": matched}
+    print(f"first match: import {imported:.1f} ms, cold match {matched:.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if over_budget:
+        print(f"Import time budget of {args.budget_ms} ms exceeded by: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
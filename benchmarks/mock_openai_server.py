@@ -0,0 +1,109 @@
+"""Local mock of the OpenAI completion endpoints injecting latency and rate limits.
+
+Answers ``/v1/completions`` and ``/v1/chat/completions`` (streamed or not)
+like ``StubClient``, after a random latency. A share of the requests is
+rejected with 429 and a Retry-After header, and requests beyond
+``--capacity`` concurrent ones are always rejected, so retries, backoff and
+the adaptive concurrency limit of ``llm_client`` can be exercised.
+
+    python benchmarks/mock_openai_server.py --port 8089 --latency 0.5 --rate-limit 0.1
+    OPENAI_API_BASE=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock python flask_webserver.py
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_client import StubClient  # noqa: E402
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub = StubClient()
+    options = argparse.Namespace(latency=0.0, jitter=0.0, rate_limit=0.0, retry_after=1.0, capacity=None)
+    in_flight = 0
+    lock = Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=()):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            overloaded = self.options.capacity is not None and cls.in_flight > self.options.capacity
+        try:
+            if overloaded or random.random() < self.options.rate_limit:
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                [("Retry-After", str(self.options.retry_after))])
+                return
+            time.sleep(max(0.0, random.gauss(self.options.latency, self.options.jitter)))
+            self._respond(request)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def _respond(self, request):
+        stream = request.pop("stream", False)
+        request = {name: value for name, value in request.items() if name in ("prompt", "messages", "functions", "function_call")}
+        if self.path.endswith("/chat/completions"):
+            response, chunks = self.stub._chat(**request), self.stub._chat_chunks
+        elif self.path.endswith("/completions"):
+            response, chunks = self.stub._complete(**request), self.stub._completion_chunks
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+            return
+        response = {"id": "mock", "object": "mock", "created": int(time.time()), **response}
+        if not stream:
+            self._send_json(200, response)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk in chunks(response):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def serve(port=8089, **options):
+    """Start the mock server on ``port``; returns the server, to be run with ``serve_forever``."""
+    MockOpenAIHandler.options = argparse.Namespace(**{**vars(MockOpenAIHandler.options), **options})
+    return ThreadingHTTPServer(("127.0.0.1", port), MockOpenAIHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of the latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests rejected with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429 responses")
+    parser.add_argument("--capacity", type=int, help="concurrent requests above which all are rejected")
+    args = parser.parse_args()
+    server = serve(args.port, latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                   retry_after=args.retry_after, capacity=args.capacity)
+    print(f"Mock OpenAI API on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Deterministic local stand-in for the ``openai`` module.
+
+``StubClient`` exposes ``Completion.create`` and ``ChatCompletion.create``
+and can be passed as the ``client`` of ``convert`` and friends. The
+completion endpoint echoes the quoted procedure of the segmentation prompt,
+one action per line. The chat endpoint answers with the requested function
+call and fills every required argument with a placeholder of its type;
+batched requests get one such call per numbered step, for the function
+matching the step best. Both sleep for ``latency`` seconds plus a random
+jitter of up to ``jitter`` seconds and support ``stream=True``.
+"""
+import json
+import random
+import re
+import time
+from threading import Lock
+
+from openai.openai_object import OpenAIObject
+
+PLACEHOLDERS = {"string": "zone", "number": 1.0, "integer": 1, "boolean": True}
+
+
+class _Endpoint:
+    def __init__(self, client, respond, stream_chunks):
+        self.client = client
+        self.respond = respond
+        self.stream_chunks = stream_chunks
+
+    def create(self, stream=False, **kwargs):
+        self.client.count_call()
+        time.sleep(self.client.latency + random.uniform(0, self.client.jitter))
+        response = self.respond(**kwargs)
+        if stream:
+            return (OpenAIObject.construct_from(chunk) for chunk in self.stream_chunks(response))
+        return OpenAIObject.construct_from(response)
+
+
+class StubClient:
+    def __init__(self, latency=0.0, chunk_size=8, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._lock = Lock()
+        self.Completion = _Endpoint(self, self._complete, self._completion_chunks)
+        self.ChatCompletion = _Endpoint(self, self._chat, self._chat_chunks)
+
+    def count_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def _complete(self, prompt, **kwargs):
+        # The segmentation prompt quotes the procedure; answer with its lines
+        procedure = prompt.split('"', 1)[1].rsplit('"', 1)[0] if prompt.count('"') >= 2 else prompt
+        text = "\n" + "\n".join(line.strip() for line in procedure.splitlines() if line.strip())
+        return {"choices": [{"index": 0, "text": text, "finish_reason": "stop"}]}
+
+    def _placeholder_arguments(self, function):
+        properties = function["parameters"]["properties"]
+        return {
+            argument: PLACEHOLDERS.get(properties[argument]["type"], "zone")
+            for argument in function["parameters"].get("required", [])
+        }
+
+    def _chat(self, messages, functions=None, function_call=None, **kwargs):
+        from generate_chatgpt_func_call import BATCH_FUNCTION
+        from match_function import match_to_function
+
+        functions = functions or []
+        name = function_call["name"] if isinstance(function_call, dict) else functions[0]["name"]
+        function = next((func for func in functions if func["name"] == name), None)
+        if name == BATCH_FUNCTION:
+            schemas = [func for func in functions if func["name"] != BATCH_FUNCTION]
+            calls = []
+            for step, action in re.findall(r"^(\d+)\. (.*)$", messages[-1]["content"], re.MULTILINE):
+                matched = next(func for func in schemas if func["name"] == match_to_function(action, schemas))
+                calls.append({"step": int(step), "name": matched["name"], "arguments": self._placeholder_arguments(matched)})
+            arguments = {"calls": calls}
+        else:
+            arguments = self._placeholder_arguments(function) if function is not None else {}
+        message = {
+            "role": "assistant",
+            "content": None,
+            "function_call": {"name": name, "arguments": json.dumps(arguments)},
+        }
+        return {"choices": [{"index": 0, "message": message, "finish_reason": "function_call"}]}
+
+    def _completion_chunks(self, response):
+        text = response["choices"][0]["text"]
+        for start in range(0, len(text), self.chunk_size):
+            yield {"choices": [{"index": 0, "text": text[start:start + self.chunk_size], "finish_reason": None}]}
+        yield {"choices": [{"index": 0, "text": "", "finish_reason": "stop"}]}
+
+    def _chat_chunks(self, response):
+        function_call = response["choices"][0]["message"]["function_call"]
+        yield {"choices": [{"index": 0, "delta": {"role": "assistant", "content": None,
+                                                  "function_call": {"name": function_call["name"], "arguments": ""}}}]}
+        arguments = function_call["arguments"]
+        for start in range(0, len(arguments), self.chunk_size):
+            yield {"choices": [{"index": 0, "delta": {"function_call": {"arguments": arguments[start:start + self.chunk_size]}}}]}
+        yield {"choices": [{"index": 0, "delta": {}, "finish_reason": "function_call"}]}
@@ -0,0 +1,180 @@
+"""Convert a JSONL file of procedures offline.
+
+Every input line is a JSON object holding a procedure, e.g.
+
+    {"id": "filtration-3", "procedure": "Transfer 3.0 mL of THF (liquid) from thf into filter_cartridge with needle 1."}
+
+One result line is appended to the output file per procedure as soon as it
+is converted:
+
+    {"id": ..., "status": "done", "code": [...], "errors": [...], "elapsed_s": ...}
+
+The output file doubles as the checkpoint: procedures whose id is already
+in it are skipped, so an interrupted run resumes where it stopped when it
+is started again with the same arguments.
+
+    python bulk_convert.py procedures.jsonl results.jsonl --workers 8
+    python bulk_convert.py runs.jsonl results.jsonl --id-field run --text-field steps
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Event
+
+import openai
+
+from generate_chatgpt_func_call import convert
+from match_function import get_matcher, warm_up
+from output_sink import CollectSink
+from llm_client import ResilientClient
+from response_cache import CachedClient, cache_from_env
+from vector_index import SpacyEmbedder
+
+
+def read_procedures(path, id_field="id", text_field="procedure"):
+    """Yield (id, procedure) for every line of a JSONL file.
+
+    Lines without ``id_field`` are identified by their line number.
+    """
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield row.get(id_field, number), row[text_field]
+
+
+def load_checkpoint(path, retry_failed=False):
+    """Ids of the procedures already in the output file.
+
+    A line cut short by a crash is removed from the file. With
+    ``retry_failed`` the failed procedures are not counted as done.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        valid = 0
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            valid += len(line)
+            if not (retry_failed and row["status"] == "failed"):
+                done.add(row["id"])
+        f.truncate(valid)
+    return done
+
+
+def convert_procedure(procedure_id, procedure, cancel, **options):
+    sink = CollectSink()
+    start = time.perf_counter()
+    status, error = "done", None
+    try:
+        convert(procedure, sink, cancel=cancel, **options)
+    except Exception as e:
+        status, error = "failed", str(e)
+    if cancel.is_set():
+        return None
+    if sink.errors and status == "done":
+        status = "partial"
+    return {
+        "id": procedure_id,
+        "status": status,
+        "code": sink.code,
+        "errors": sink.errors,
+        "error": error,
+        "elapsed_s": round(time.perf_counter() - start, 3),
+    }
+
+
+def run(procedures, output_path, workers=4, retry_failed=False, sync_every=10, **options):
+    """Convert ``procedures``, (id, text) pairs, appending the results to ``output_path``.
+
+    At most ``2 * workers`` procedures are read ahead of the conversion.
+    The output is flushed after every result and synced to disk every
+    ``sync_every`` results. Returns the number of procedures converted.
+    """
+    done = load_checkpoint(output_path, retry_failed)
+    cancel = Event()
+    converted = 0
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+
+        def write(future):
+            nonlocal converted
+            pending.discard(future)
+            result = future.result()
+            if result is None:
+                return
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            converted += 1
+            if converted % sync_every == 0:
+                os.fsync(output.fileno())
+            print(f"{result['id']}: {result['status']}, {len(result['code'])} lines in {result['elapsed_s']} s", file=sys.stderr)
+
+        try:
+            for procedure_id, procedure in procedures:
+                if procedure_id in done:
+                    continue
+                done.add(procedure_id)
+                pending.add(executor.submit(convert_procedure, procedure_id, procedure, cancel, **options))
+                if len(pending) >= 2 * workers:
+                    for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                        write(future)
+            for future in list(pending):
+                write(future)
+        except KeyboardInterrupt:
+            # Procedures in progress are dropped and converted again on the next run
+            cancel.set()
+            for future in list(pending):
+                if future.done():
+                    write(future)
+            print("Interrupted, rerun the same command to resume.", file=sys.stderr)
+        os.fsync(output.fileno())
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of procedures")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="procedure")
+    parser.add_argument("--workers", type=int, default=4, help="procedures converted at once")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight per procedure")
+    parser.add_argument("--batch-size", type=int, default=8, help="actions translated per OpenAI request")
+    parser.add_argument("--schema-top-k", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60, help="per-request OpenAI timeout in seconds")
+    parser.add_argument("--no-fast-path", dest="fast_path", action="store_false",
+                        help="send every action to the model")
+    parser.add_argument("--dense-model", help="local spaCy model whose word vectors are fused into the matching")
+    parser.add_argument("--dense-weight", type=float, default=0.5)
+    parser.add_argument("--retry-failed", action="store_true", help="convert failed procedures again")
+    args = parser.parse_args()
+
+    openai.api_key = os.environ.get("OPENAI_API_KEY")
+    llm_client = ResilientClient(openai, max_concurrency=args.workers * max(args.concurrency, 1), timeout=args.timeout)
+    response_cache = cache_from_env()
+    client = CachedClient(llm_client, response_cache) if response_cache is not None else llm_client
+    if args.dense_model:
+        get_matcher().configure_dense(SpacyEmbedder(args.dense_model), args.dense_weight)
+    warm_up(background=False)
+
+    converted = run(
+        read_procedures(args.input, args.id_field, args.text_field), args.output, workers=args.workers,
+        retry_failed=args.retry_failed, concurrency=args.concurrency, batch_size=args.batch_size,
+        schema_top_k=args.schema_top_k, timeout=args.timeout, fast_path=args.fast_path, client=client,
+    )
+    print(f"{converted} procedures converted", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import ast
+import keyword
+import re
+
+from jsonschema import Draft7Validator
+
+INTEGER = re.compile(r"^[+-]?\d+$")
+QUOTES = "\"'"
+
+
+class InvalidCall(ValueError):
+    """Raised when a function call does not match the schema of its function."""
+
+    def __init__(self, name, errors):
+        super().__init__(f"Invalid call of {name}: {'; '.join(errors)}")
+        self.name = name
+        self.errors = errors
+
+
+def coerce_value(value, schema):
+    """Convert ``value`` to the JSON type of ``schema``.
+
+    Models often return numbers as strings ("30") and wrap zone names in
+    extra quotes; both are undone here. Raises ValueError if the value
+    cannot be converted.
+    """
+    type_ = schema.get("type")
+    if type_ == "integer":
+        if isinstance(value, bool):
+            raise ValueError(f"{value!r} is not an integer")
+        if isinstance(value, str):
+            value = value.strip()
+            if not INTEGER.match(value):
+                value = float(value)
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"{value!r} is not an integer")
+        return int(value)
+    if type_ == "number":
+        if isinstance(value, bool):
+            raise ValueError(f"{value!r} is not a number")
+        if isinstance(value, str):
+            value = value.strip()
+            return int(value) if INTEGER.match(value) else float(value)
+        return value
+    if type_ == "boolean" and isinstance(value, str):
+        if value.strip().lower() in ("true", "false"):
+            return value.strip().lower() == "true"
+        raise ValueError(f"{value!r} is not a boolean")
+    if type_ == "string" and not isinstance(value, str):
+        return str(value)
+    if type_ == "string":
+        return value.strip().strip(QUOTES)
+    return value
+
+
+def coerce_arguments(arguments, schema):
+    """Arguments converted to the types of the function ``schema``, and the conversion errors."""
+    properties = schema["parameters"].get("properties", {})
+    coerced = {}
+    errors = []
+    for name, value in arguments.items():
+        if name in properties and value is not None:
+            try:
+                value = coerce_value(value, properties[name])
+            except (TypeError, ValueError) as e:
+                errors.append(f"{name}: {e}")
+                continue
+        coerced[name] = value
+    return coerced, errors
+
+
+def _value_node(value):
+    # Zone names are variables of the generated script
+    if isinstance(value, str) and value.isidentifier() and not keyword.iskeyword(value):
+        return ast.Name(id=value, ctx=ast.Load())
+    return ast.Constant(value=value)
+
+
+def render_call(function_name, arguments, routine=False):
+    """Chemspyd code calling ``function_name`` with ``arguments``.
+
+    Routine functions are called through the routines module with the
+    Chemspeed manager as first argument.
+    """
+    keywords = [ast.keyword(arg="chmspd", value=ast.Name(id="chmspd", ctx=ast.Load()))] if routine else []
+    keywords += [ast.keyword(arg=name, value=_value_node(value)) for name, value in arguments.items()]
+    module = ast.Name(id="routines" if routine else "chemspd", ctx=ast.Load())
+    call = ast.Call(func=ast.Attribute(value=module, attr=function_name, ctx=ast.Load()), args=[], keywords=keywords)
+    return ast.unparse(call)
+
+
+def validate_call(function_name, arguments, schema, validator=None):
+    """Coerce and validate the arguments of a function call and return them.
+
+    ``schema`` is the OpenAI schema of the function; ``validator`` its
+    precompiled jsonschema validator if available. Raises ``InvalidCall``
+    if an argument is not a parameter of the schema or cannot be a Python
+    keyword argument, has the wrong type, is not one of the ``enum``
+    values of its schema, or a required argument is missing.
+    """
+    if not isinstance(arguments, dict):
+        raise InvalidCall(function_name, [f"{arguments!r} is not an object"])
+    properties = schema["parameters"].get("properties", {})
+    errors = [f"{name}: unknown argument" for name in arguments if name not in properties]
+    errors += [f"{name}: not a valid argument name" for name in arguments
+               if name in properties and (not name.isidentifier() or keyword.iskeyword(name))]
+    arguments, coercion_errors = coerce_arguments(arguments, schema)
+    errors += coercion_errors
+    if validator is None:
+        validator = Draft7Validator(schema["parameters"])
+    errors += [error.message for error in validator.iter_errors(arguments)]
+    if errors:
+        raise InvalidCall(function_name, errors)
+    return arguments
+
+
+def emit_call(function_name, arguments, schema, routine=False, validator=None):
+    """Coerce, validate and render a function call, see ``validate_call``."""
+    return render_call(function_name, validate_call(function_name, arguments, schema, validator), routine)
@@ -1,47 +1,186 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, abort, current_app, render_template, request
 from flask_socketio import SocketIO, emit
+import hashlib
+import hmac
 import os
-from threading import Thread, Lock
 import json
+import weakref
+from functools import partial
 import openai
-from generate_chatgpt_func_call import convert
+from incremental import IncrementalTranslator
+from match_function import get_matcher, warm_up
+from vector_index import SpacyEmbedder
+from job_manager import JobManager, QueueFull
+from response_cache import CachedClient, cache_from_env
+from llm_client import ResilientClient, parse_token_budgets
+import metrics
+from socketio_queue import client_manager
 
-def translate(input):
+def translate(translations, input, socketio, cancel):
     """Function that translates the input to Python"""
-    openai.api_key = os.environ.get("OPENAI_API_KEY")
-    #openai.organization = os.environ.get("OPENAI_ORGANIZATION_ID")
-    
-    # Get the output
-    convert(input, socketio)
+    # Get the output, retranslating only the lines changed since the last translation of the session
+    translations.translate(socketio.room, input, socketio, cancel, concurrency=CONVERT_CONCURRENCY, timeout=OPENAI_TIMEOUT,
+                           client=client, stream=STREAM_OUTPUT, max_pending=MAX_PENDING_ACTIONS, schema_top_k=SCHEMA_TOP_K,
+                           schema_min_score=SCHEMA_MIN_SCORE, batch_size=BATCH_SIZE)
 
 
-# Flask app
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(32)
-app.config["SESSION_COOKIE_SECURE"] = True
-socketio = SocketIO(app)
+# Number of actions translated concurrently and per-request OpenAI timeout (in sec)
+CONVERT_CONCURRENCY = int(os.environ.get("CONVERT_CONCURRENCY", 4))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 60))
+# Stream the segmentation and the generated code to the browser
+STREAM_OUTPUT = os.environ.get("STREAM_OUTPUT", "1") == "1"
+# Segmented actions waiting for translation before the segmentation stream is paused
+MAX_PENDING_ACTIONS = int(os.environ.get("MAX_PENDING_ACTIONS", 16))
+# Send only the best matching function schemas to the model (all of them if SCHEMA_TOP_K is empty)
+SCHEMA_TOP_K = os.environ.get("SCHEMA_TOP_K", "3")
+SCHEMA_TOP_K = int(SCHEMA_TOP_K) if SCHEMA_TOP_K else None
+SCHEMA_MIN_SCORE = float(os.environ.get("SCHEMA_MIN_SCORE", 0.1))
+# Actions translated per OpenAI request when the output is not streamed
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 8))
+# Procedures translated at once, and jobs allowed to wait overall and per session
+TRANSLATION_WORKERS = int(os.environ.get("TRANSLATION_WORKERS", 4))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 64))
+MAX_JOBS_PER_SESSION = int(os.environ.get("MAX_JOBS_PER_SESSION", 2))
 
-# Global variables
-thread = None
-thread_lock = Lock()
-input = ""
+# Collect the pipeline metrics served on /metrics
+if os.environ.get("METRICS", "1") == "1":
+    metrics.enable()
 
+# Fuse the TF-IDF matching with the word vectors of a local spaCy model (off if DENSE_MATCH_MODEL is empty)
+DENSE_MATCH_MODEL = os.environ.get("DENSE_MATCH_MODEL", "")
+DENSE_MATCH_WEIGHT = float(os.environ.get("DENSE_MATCH_WEIGHT", 0.5))
+if DENSE_MATCH_MODEL:
+    get_matcher().configure_dense(SpacyEmbedder(DENSE_MATCH_MODEL), DENSE_MATCH_WEIGHT)
 
-def run_translation(input):
-    """Function that runs the translation in a separate thread."""
-    global thread
-    with thread_lock:
-        thread = Thread(target=translate, args=(input,))
-        thread.start()
+# Load the spaCy model and build the function index in the background at boot
+WARM_UP = os.environ.get("WARM_UP", "1") == "1"
+
+# The API key is set once; requests share a pooled client with retries and adaptive concurrency
+openai.api_key = os.environ.get("OPENAI_API_KEY")
+#openai.organization = os.environ.get("OPENAI_ORGANIZATION_ID")
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 5))
+LLM_TOKENS_PER_MINUTE = parse_token_budgets(os.environ.get("LLM_TOKENS_PER_MINUTE", ""))
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "1") == "1"
+llm_client = ResilientClient(openai, max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES, timeout=OPENAI_TIMEOUT,
+                             tokens_per_minute=LLM_TOKENS_PER_MINUTE, hedge=LLM_HEDGE)
+
+# OpenAI responses are cached on disk unless RESPONSE_CACHE_PATH is empty
+response_cache = cache_from_env()
+client = CachedClient(llm_client, response_cache) if response_cache is not None else llm_client
+
+# Job managers of the apps created in this process, reported together on /metrics
+job_managers = weakref.WeakSet()
+
+metrics.register_gauge("llm_concurrency_limit", "Adaptive limit of concurrent OpenAI requests.", lambda: llm_client.limit.limit)
+metrics.register_gauge("llm_requests_in_flight", "OpenAI requests in flight.", lambda: llm_client.limit.in_flight)
+metrics.register_gauge("queued_jobs", "Translations waiting for a worker.",
+                       lambda: sum(jobs.queue_depth() for jobs in list(job_managers)))
+metrics.register_gauge("active_jobs", "Translations queued or running.",
+                       lambda: sum(len(jobs.active_jobs()) for jobs in list(job_managers)))
+if response_cache is not None:
+    metrics.register_gauge("response_cache", "Response cache hits, misses, hit rate and size.",
+                           lambda: {(("stat", name),): value for name, value in response_cache.stats().items()})
+
+
+def run_translation(input, sid, trace=False, compact=True):
+    """Function that queues the translation for the session ``sid``."""
+    jobs = current_app.extensions["translation_jobs"]
+    # A new submission replaces the running translation of the session
+    jobs.cancel_room(sid)
+    try:
+        jobs.submit(sid, input, trace, compact)
+    except QueueFull as e:
+        current_app.extensions["socketio"].emit("job_status", {"job": None, "status": "rejected", "error": str(e)}, to=sid)
+
+def session_token(sid):
+    """Function that returns the token proving that a form was posted by the page of the session ``sid``."""
+    return hmac.new(current_app.config["SECRET_KEY"], sid.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def connect():
+    """Function that sends the session token used by the form of the page."""
+    emit("session_token", session_token(request.sid))
+
+def translate_event(data):
+    """Function that queues the translation submitted over the Socket.IO connection."""
+    run_translation(data["input"], request.sid, bool(data.get("trace")), not data.get("verbose"))
+
+def cancel_job(job_id):
+    """Function that cancels a job of the requesting session."""
+    current_app.extensions["translation_jobs"].cancel(job_id, room=request.sid)
+
+def disconnect():
+    """Function that cancels the jobs of a disconnected session."""
+    current_app.extensions["translation_jobs"].cancel_room(request.sid)
+    current_app.extensions["translations"].forget(request.sid)
 
-@app.route("/", methods=["GET", "POST"])
 def index():
     """Function that renders the index page."""
-    global input
-    if request.method == "POST":              
-        input = request.form["input_field"]
-        run_translation(input)
+    if request.method == "POST":
+        sid = request.form.get("sid")
+        if sid:
+            # Only the page holding the session may route translations to it or replace its job
+            if not hmac.compare_digest(request.form.get("token", ""), session_token(sid)):
+                abort(403)
+            run_translation(request.form["input_field"], sid, request.form.get("trace") == "on",
+                            request.form.get("verbose") != "on")
+
+    return render_template("index.html", transports=current_app.config["SOCKETIO_TRANSPORTS"])
+
+def metrics_endpoint():
+    """Function that serves the pipeline metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def create_app(async_mode=None, message_queue=None, preload=False, websocket_only=False):
+    """Function that creates the Flask app with its own Socket.IO server and translation jobs.
+
+    ``async_mode`` is the Flask-SocketIO mode (threading, eventlet or gevent,
+    detected from the installed packages by default). With ``message_queue``,
+    a Redis, RabbitMQ or Kafka URL or ``sqlite:///path`` and ``local://`` for
+    the stand-ins of ``socketio_queue``, several server processes share the
+    Socket.IO sessions. With ``preload`` the spaCy model and the function
+    index are loaded before returning, so that worker processes forked
+    afterwards share them copy-on-write. With ``websocket_only`` the browser
+    connects without long-polling, which needs no sticky sessions.
+
+    The Socket.IO server is ``app.extensions["socketio"]``, the job manager
+    ``app.extensions["translation_jobs"]`` and the last translations of the
+    sessions ``app.extensions["translations"]``.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.urandom(32)
+    app.config["SESSION_COOKIE_SECURE"] = True
+    app.config["SOCKETIO_TRANSPORTS"] = ["websocket"] if websocket_only else ["polling", "websocket"]
+    app.add_url_rule("/", view_func=index, methods=["GET", "POST"])
+    app.add_url_rule("/metrics", view_func=metrics_endpoint)
+
+    options = {}
+    if message_queue:
+        manager = client_manager(message_queue)
+        if manager is not None:
+            options["client_manager"] = manager
+        else:
+            options["message_queue"] = message_queue
+    socketio = SocketIO(app, async_mode=async_mode, **options)
+    for event, handler in [("connect", connect), ("translate", translate_event), ("cancel_job", cancel_job),
+                           ("disconnect", disconnect)]:
+        socketio.on_event(event, handler)
+
+    # Last translated procedure of every session
+    translations = app.extensions["translations"] = IncrementalTranslator()
+    # Translation jobs, each routed to the Socket.IO room of the session that submitted it
+    jobs = app.extensions["translation_jobs"] = JobManager(socketio, partial(translate, translations),
+                                                           max_workers=TRANSLATION_WORKERS, max_queued=MAX_QUEUED_JOBS,
+                                                           max_jobs_per_room=MAX_JOBS_PER_SESSION)
+    job_managers.add(jobs)
+
+    if preload:
+        warm_up(background=False)
+    elif WARM_UP:
+        warm_up()
+    return app
 
-    return render_template("index.html", input=input)
 
-socketio.run(app, debug=True, port=3000)
+if __name__ == "__main__":
+    app = create_app()
+    app.extensions["socketio"].run(app, debug=True, port=3000)
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import time
+from threading import Lock, Thread
+
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import SchemaError
+
+from code_emitter import InvalidCall, emit_call
+from match_function import get_matcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chemspeed_functions.json")
+
+
+class Catalog:
+    """Immutable, precompiled view of one version of the function catalog.
+
+    ``functions`` is the list of OpenAI function schemas. Everything the
+    hot paths derive from it is computed once: the name -> schema lookup,
+    the set of routine functions, the required arguments and the
+    jsonschema validators of every function.
+    """
+
+    def __init__(self, functions, routine_functions, mtime=None):
+        self.functions = functions
+        self.routine_functions = frozenset(routine_functions)
+        self.mtime = mtime
+        self.by_name = {func["name"]: func for func in functions}
+        self.required = {func["name"]: tuple(func["parameters"].get("required", [])) for func in functions}
+        self.validators = {func["name"]: Draft7Validator(func["parameters"]) for func in functions}
+
+    @classmethod
+    def load(cls, path):
+        mtime = os.stat(path).st_mtime
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for func in data["functions"]:
+            Draft7Validator.check_schema(func["parameters"])
+        return cls(data["functions"], data.get("routine_functions", []), mtime)
+
+    @property
+    def names(self):
+        return list(self.by_name)
+
+    def validate(self, name, arguments):
+        """Error messages of ``arguments`` against the schema of ``name`` (empty if valid)."""
+        if name not in self.validators:
+            return [f"Unknown function {name!r}"]
+        return [error.message for error in self.validators[name].iter_errors(arguments)]
+
+    def emit(self, name, arguments):
+        """Validated code of a call of ``name``, see ``code_emitter.emit_call``."""
+        if name not in self.by_name:
+            raise InvalidCall(name, [f"Unknown function {name!r}"])
+        return emit_call(name, arguments, self.by_name[name], name in self.routine_functions, self.validators[name])
+
+    def build_index(self):
+        """Build the TF-IDF index of the matcher for this catalog."""
+        get_matcher().ensure_fitted(self.functions)
+
+
+class FunctionRegistry:
+    """Function catalog loaded from a JSON file and reloaded when the file changes.
+
+    The file is checked at most every ``check_interval`` seconds when the
+    catalog is accessed. A new version is loaded and compiled completely
+    before it replaces the current one, so readers always see a consistent
+    catalog; a file that fails to load keeps the previous version. After a
+    reload the matcher index is rebuilt in the background.
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = Lock()
+        self._checked = time.monotonic()
+        self._failed_mtime = None
+        self._catalog = Catalog.load(path)
+
+    @property
+    def catalog(self):
+        if time.monotonic() - self._checked >= self.check_interval:
+            self.reload_if_changed()
+        return self._catalog
+
+    @property
+    def functions(self):
+        return self.catalog.functions
+
+    def reload_if_changed(self):
+        """Reload the catalog if the file was modified. True if it was reloaded."""
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                # Missing, e.g. renamed while being saved; keep the current catalog
+                return False
+            if mtime in (self._catalog.mtime, self._failed_mtime):
+                return False
+            try:
+                catalog = Catalog.load(self.path)
+            except (OSError, ValueError, KeyError, SchemaError) as e:
+                logger.warning("Could not reload the function catalog %s: %s", self.path, e)
+                self._failed_mtime = mtime
+                return False
+            self._catalog = catalog
+        # Rebuild the matcher index off the request path if matching is in use
+        if get_matcher().index is not None:
+            Thread(target=catalog.build_index, name="function-index", daemon=True).start()
+        return True
+
+
+_registry = None
+_registry_lock = Lock()
+
+
+def get_registry():
+    """Return the shared registry, loading the catalog on first use.
+
+    The catalog file can be overridden with the FUNCTION_CATALOG_PATH
+    environment variable.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FunctionRegistry(os.environ.get("FUNCTION_CATALOG_PATH", DEFAULT_CATALOG_PATH))
+        return _registry
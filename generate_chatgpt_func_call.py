@@ -1,223 +1,564 @@
 import openai
 import json
-from match_function import match_to_function
-
-
-functions = [
-        {
-            "name": "prime_pumps",
-            "description": "Primes the ChemSpeed pumps.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "pump": {
-                        "type": "string",
-                        "description": "pump being primed",
-                    },
-                    "volume": {
-                        "type": "string",
-                        "description": "volume with which to prime pumps"},
-                },
-                "required": ["pump", "volume"],
-            },
-        },
-        {
-            "name": "transfer_liquid",
-            "description": "Executes a liquid transfer from the source to the target zone.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "source": {
-                        "type": "string",
-                        "description": "Source zone for the liquid transfer."
-                    },
-                    "destination": {
-                        "type": "string",
-                        "description": "Destination zone for the liquid transfer."
-                    },
-                    "volume": {
-                        "type": "number",
-                        "description": "Volume to transfer [mL]"
-                    },
-                    "needle": {
-                        "type": "integer",
-                        "description": "Number of the needle to use (0 means all needles)."
-                    },
-                },
-                "required": ["source", "destination", "volume", "needle"],
-            },
-        },
-        {
-            "name": "transfer_solid",
-            "description": "Executes a solid transfer from the source to the target destination.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "source": {
-                        "type": "string",
-                        "description": "Source zone for the solid transfer."
-                    },
-                    "destination": {
-                        "type": "string",
-                        "description": "Destination zone for the solid transfer."
-                    },
-                    "weight": {
-                        "type": "number",
-                        "description": "Mass to dispense [mg]"
-                    },
-                },
-                "required": ["source", "destination", "weight"],
-            },
-        },
-        {
-            "name": "do_schlenk_cycles",
-            "description": "Performs Schlenk Cycles (evacuate-refill cycles) on the specified wells.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "wells": {
-                        "type": "string",
-                        "description": "Zones to be set to inert gas."
-                    },
-                    "evac_time": {
-                        "type": "integer",
-                        "description": "Time (in sec) for evacuation. Default: 60 sec."
-                    },
-                    "backfill_time": {
-                        "type": "integer",
-                        "description": "Time (in sec) for backfilling with inert gas. Default: 30 sec."
-                    },
-                },
-                "required": ["wells"],
-            },
-        },
-        {
-            "name": "heat_under_reflux",
-            "description": "Sets up the heating and the reflux condenser for a specified time period. Cools the system back to room temperature for a specified cooling period.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "wells": {
-                        "type": "string",
-                        "description": "wells to be heated under reflux."
-                    },
-                    "stir_rate": {
-                        "type": "number",
-                        "description": "Stir rate (in rpm)"
-                    },
-                    "temperature": {
-                        "type": "number",
-                        "description": "Heating temperature (in °C)"
-                    },
-                    "heating_hours": {
-                        "type": "integer",
-                        "description": "Heating time (in h)"
-                    },
-                    "cooling_hours": {
-                        "type": "integer",
-                        "description": "Cooling time (in h)"
-                    },
-                    "condenser_temperature": {
-                        "type": "number",
-                        "description": "Temperature (in °C) of the reflux condenser."
-                    },
-                },
-                "required": ["wells", "stir_rate", "temperature", "heating_hours", "cooling_hours"],
-            },
-        },
-        {
-            "name": "filter_liquid",
-            "description": "Filters a liquid sample on a filtration rack. Allows for collecting the filtrate, washing and eluting the filter.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "source_well": {
-                        "type": "string",
-                        "description": "Source well of the sample to be filtered."
-                    },
-                    "filtration_zone": {
-                        "type": "string",
-                        "description": "Zone on the filtration rack to be used."
-                    },
-                    "filtration_volume": {
-                        "type": "number",
-                        "description": "Volume (in mL) of liquid to be filtered."
-                    },
-                },
-                "required": ["source_well", "filtration_zone", "filtration_volume"],
-            },
-        },
-    ]
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from match_function import match_to_function, match_many
+from rule_extractor import extract_arguments
+from pipeline import run_pipeline
+from function_registry import get_registry
+from code_emitter import InvalidCall, emit_call, render_call
+from output_sink import PrintSink
+import metrics
+from metrics import span
+
+logger = logging.getLogger(__name__)
 
-def segment(prompt, socketio):
-    prompt = f"Transform the following instructions into structured actions:\n\"{prompt}\".\n\nActions:\n"
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Shared by every translation request so the prompt prefix stays identical across actions
+PROMPT_PREFIX = (
+    {"role":"system", "content":"You are a natural language to Chemspeed translator, you must also do your best to correct any incorrect Chemspeed, only use items contained in the description. Convert to your best estimate even if not enough information is provided" },
+    {"role": "user", "content": "Prime pump 1 with 30 mL using chemspd as manager."},
+    {"role": "assistant", "content": "", "function_call": {'name': 'prime_pump', 'arguments': "{'pump': '1', 'volume': '30', 'manager': 'chemspd'}"}},
+    # {"role": "user", "content": "Transfer 10 mL of liquid from the source zone to the destination zone using needle 1."},
+)
+
+# Function the model calls to translate several actions in one request
+BATCH_FUNCTION = "translate_steps"
+
+
+def debug(socketio, message):
+    """Emit a free-text progress ``message`` unless ``socketio`` has a true ``compact`` attribute."""
+    if not getattr(socketio, "compact", False):
+        socketio.emit("message", message)
+
+def segment_prompt(prompt):
+    return f"Transform the following instructions into structured actions:\n\"{prompt}\".\n\nActions:\n"
+
+def segment(prompt, socketio, client=openai, timeout=None):
+    prompt = segment_prompt(prompt)
 
     # Generate structured actions using OpenAI's GPT model
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=prompt,
-        max_tokens=2000,
-        temperature=0,
-        stop=None
-    )
+    with span("segment", socketio):
+        response = client.Completion.create(
+            engine="text-davinci-003",
+            prompt=prompt,
+            max_tokens=2000,
+            temperature=0,
+            stop=None,
+            request_timeout=timeout,
+        )
     actions = response.choices[0].text.strip().split("\n")
-    socketio.emit("message", f"{actions}")
+    debug(socketio, f"{actions}")
     return actions
 
-def convert_action_to_function(action, functions, socketio):
-    routine_functions = ["prime_pumps", "inject_to_hplc", "do_schlenk_cycles", "heat_under_reflux", "filter_liquid", "set_isynth_drawers"]
-    messages = [{"role":"system", "content":"You are a natural language to Chemspeed translator, you must also do your best to correct any incorrect Chemspeed, only use items contained in the description. Convert to your best estimate even if not enough information is provided" },
-                {"role": "user", "content": "Prime pump 1 with 30 mL using chemspd as manager."},
-                {"role": "assistant", "content": "", "function_call": {'name': 'prime_pump', 'arguments': "{'pump': '1', 'volume': '30', 'manager': 'chemspd'}"}},
-                # {"role": "user", "content": "Transfer 10 mL of liquid from the source zone to the destination zone using needle 1."},
-                {"role": "user", "content": "Translate the following into Chemspeed syntax "+ action}]
+def segment_stream(prompt, socketio, client=openai, timeout=None):
+    """Streaming version of ``segment`` yielding each action as soon as its line is complete."""
+    with span("segment_request", socketio):
+        response = client.Completion.create(
+            engine="text-davinci-003",
+            prompt=segment_prompt(prompt),
+            max_tokens=2000,
+            temperature=0,
+            stop=None,
+            stream=True,
+            request_timeout=timeout,
+        )
+    actions = []
+    buffer = ""
+    for chunk in response:
+        buffer += chunk["choices"][0].get("text") or ""
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                actions.append(line.strip())
+                yield actions[-1]
+    if buffer.strip():
+        actions.append(buffer.strip())
+        yield actions[-1]
+    debug(socketio, f"{actions}")
+
+def partial_arguments(arguments):
+    """Best-effort parse of a truncated JSON arguments object.
+
+    Returns the complete key/value pairs received so far.
+    """
+    for closing in ("", "}", "\"}", "null}", ":null}"):
+        try:
+            parsed = json.loads(arguments + closing)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            return {name: value for name, value in parsed.items() if value not in (None, "")}
+    # Fall back to the arguments before the last comma
+    if "," in arguments:
+        return partial_arguments(arguments[:arguments.rindex(",")])
+    return {}
+
+def build_function_code(function_name, function_args, routine_functions=None):
+    """Chemspyd call for ``function_name`` with the given arguments.
+
+    Routine functions (by default those of the registry catalog) are called
+    through the routines module with the Chemspeed manager as first argument.
+    """
+    if routine_functions is None:
+        routine_functions = get_registry().catalog.routine_functions
+    return render_call(function_name, function_args, function_name in routine_functions)
+
+def emit_function_code(functions, function_name, function_args):
+    """Validated code of a call of ``function_name``, see ``code_emitter.emit_call``.
+
+    Raises ``InvalidCall`` if the arguments do not match its schema in ``functions``.
+    """
+    catalog = get_registry().catalog
+    if functions is catalog.functions:
+        return catalog.emit(function_name, function_args)
+    schema = next((func for func in functions if func["name"] == function_name), None)
+    if schema is None:
+        raise InvalidCall(function_name, [f"Unknown function {function_name!r}"])
+    if schema is catalog.by_name.get(function_name):
+        # Reuse the precompiled validator of the catalog
+        return catalog.emit(function_name, function_args)
+    return emit_call(function_name, function_args, schema, function_name in catalog.routine_functions)
+
+def rule_based_code(action, functions, socketio, matched_function):
+    """Code of ``action`` from the arguments extracted by rules, or None if they are incomplete."""
+    function_args = extract_arguments(action, function_schema(functions, matched_function))
+    if function_args is None:
+        return None
+    try:
+        function_code = emit_function_code(functions, matched_function, function_args)
+    except InvalidCall:
+        return None
+    debug(socketio, f"Rule-based translation ({matched_function}): {function_code}")
+    return function_code
+
+def stream_function_call(response, function_name, socketio, index):
+    """Consume a streamed function call, pushing the partial code on every new argument."""
+    arguments = ""
+    emitted = None
+    for chunk in response:
+        function_call = chunk["choices"][0].get("delta", {}).get("function_call")
+        if not function_call:
+            continue
+        function_name = function_call.get("name") or function_name
+        arguments += function_call.get("arguments") or ""
+        partial_code = build_function_code(function_name, partial_arguments(arguments))
+        if partial_code != emitted:
+            socketio.emit("partial_structured", {"index": index, "code": partial_code, "done": False})
+            emitted = partial_code
+    return {"role": "assistant", "content": None, "function_call": {"name": function_name, "arguments": arguments}}
+
+def function_schema(functions, name):
+    """Schema of ``name``, looked up in the precompiled catalog when ``functions`` is the registry's."""
+    catalog = get_registry().catalog
+    if functions is catalog.functions:
+        return catalog.by_name[name]
+    return next(func for func in functions if func["name"] == name)
+
+def count_tokens(messages, functions, model="gpt-4"):
+    """Number of input tokens of a chat request.
+
+    Uses tiktoken when it is installed and about four characters per token
+    otherwise. Function schemas are counted as their JSON.
+    """
+    text = json.dumps(messages) + json.dumps(functions)
+    if tiktoken is None:
+        return len(text) // 4
+    return len(tiktoken.encoding_for_model(model).encode(text))
+
+def record_usage(response, prompt_tokens):
+    """Count the tokens of a request in the metrics.
+
+    The usage reported in ``response`` is used when available; otherwise
+    (e.g. for streamed responses) the estimated ``prompt_tokens`` are counted.
+    """
+    usage = response.get("usage") if response is not None else None
+    if usage:
+        metrics.inc("tokens", usage["prompt_tokens"], kind="prompt")
+        metrics.inc("tokens", usage["completion_tokens"], kind="completion")
+    else:
+        metrics.inc("tokens", prompt_tokens, kind="prompt_estimated")
+
+def select_schemas(candidates, functions, top_k, min_score=0.0, required=()):
+    """Schemas of the ``top_k`` best candidates scoring at least ``min_score``.
+
+    ``candidates`` are ranked (name, score) pairs, or a list of such rankings
+    whose selections are merged. The names in ``required`` are always kept,
+    and the schemas keep their catalog order so the prompt is stable.
+    """
+    if candidates and isinstance(candidates[0], tuple):
+        candidates = [candidates]
+    names = set(required)
+    for ranking in candidates:
+        names.update(name for name, score in ranking[:top_k] if score >= min_score)
+    return [func for func in functions if func["name"] in names]
+
+def translate_action(action, functions, socketio, matched_function=None, client=openai, timeout=None, fast_path=True, stream=False, index=None, schemas=None):
+    """Translate a single action and return the generated code, or None.
+
+    Unlike ``convert_action_to_function`` this does not emit the result on
+    ``correct_structured``, so callers can control the emission order.
+    With ``fast_path`` the arguments are first extracted by rules and the
+    LLM is only called if a required argument cannot be extracted.
+    With ``stream`` the code is pushed on ``partial_structured`` as the
+    arguments arrive, tagged with the step ``index``. ``schemas`` are the
+    function schemas sent to the model, all of ``functions`` by default.
+    """
+    if matched_function is None:
+        matched_function = match_to_function(action, functions)
+
+    if fast_path:
+        with span("rules", socketio):
+            function_code = rule_based_code(action, functions, socketio, matched_function)
+        if function_code is not None:
+            return function_code
+
+    messages = [*PROMPT_PREFIX, {"role": "user", "content": "Translate the following into Chemspeed syntax "+ action}]
+    if schemas is None:
+        schemas = functions
     
-    socketio.emit("message", f"Function matched: {match_to_function(action, functions)}")
-
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=messages,
-        functions=functions,
-        function_call={"name": match_to_function(action, functions)},
-        #temperature = 0,
-        #top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0,
-        stream=False,
-    )
-    response_message = json.loads(str(response["choices"][0]["message"]))
-    socketio.emit("message", f"{response_message}, {type(response_message)}")
-
-    if response_message.get("function_call"):
-        function_name = response_message["function_call"]["name"]
-        function_args = json.loads(response_message["function_call"]["arguments"])
-        print(function_args)
-        arguments = []
-        if function_name in routine_functions:
-            function_code = f"routines.{function_name}("
-            arguments.append("chmspd=chmspd")
+    debug(socketio, f"Function matched: {matched_function}")
+    prompt_tokens = count_tokens(messages, schemas)
+    debug(socketio, f"Prompt: {prompt_tokens} tokens, {len(schemas)}/{len(functions)} function schemas")
+
+    with span("chat_completion", socketio):
+        response = client.ChatCompletion.create(
+            model="gpt-4",
+            messages=messages,
+            functions=schemas,
+            function_call={"name": matched_function},
+            #temperature = 0,
+            #top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stream=stream,
+            request_timeout=timeout,
+        )
+        if stream:
+            response_message = stream_function_call(response, matched_function, socketio, index)
         else:
-            function_code = f"chemspd.{function_name}("
-        for arg_name in function_args:
-            arg_value = function_args[arg_name]
-            if type(arg_value) is str:
-                arg_value.replace('"', '')
-            arguments.append(f"{arg_name}={arg_value}")
-        function_code += ", ".join(arguments)
-        function_code += ")"
-
-        socketio.emit("message", function_code)
+            response_message = response["choices"][0]["message"]
+    record_usage(None if stream else response, prompt_tokens)
+    debug(socketio, f"{response_message}, {type(response_message)}")
+
+    function_code = None
+    try:
+        if response_message.get("function_call"):
+            function_name = response_message["function_call"]["name"]
+            function_args = json.loads(response_message["function_call"]["arguments"])
+            logger.debug("function %s arguments %s", function_name, function_args)
+            with span("emit_code", socketio):
+                function_code = emit_function_code(functions, function_name, function_args)
+
+            debug(socketio, function_code)
+    finally:
+        if stream:
+            socketio.emit("partial_structured", {"index": index, "code": function_code, "done": True})
+    debug(socketio, response_message)
+    return function_code
+
+def batch_schema(schemas):
+    """Schema of the function returning the calls of several numbered steps at once."""
+    return {
+        "name": BATCH_FUNCTION,
+        "description": "Translates every numbered step into one call of the other functions.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "calls": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "step": {"type": "integer", "description": "Number of the step"},
+                            "name": {"type": "string", "enum": [func["name"] for func in schemas]},
+                            "arguments": {"type": "object", "description": "Arguments of the function"},
+                        },
+                        "required": ["step", "name", "arguments"],
+                    },
+                },
+            },
+            "required": ["calls"],
+        },
+    }
+
+def parse_batch(response_message, count):
+    """(name, arguments) of each of the ``count`` steps of a batched answer.
+
+    Steps that are missing, or answered more than once, are None; calls of
+    steps out of range are ignored.
+    """
+    calls = [None] * count
+    seen, duplicates = set(), set()
+    function_call = response_message.get("function_call")
+    if not function_call:
+        return calls
+    try:
+        batch = json.loads(function_call["arguments"])
+    except ValueError:
+        return calls
+    for call in batch.get("calls", []) if isinstance(batch, dict) else []:
+        if not isinstance(call, dict):
+            continue
+        step, arguments = call.get("step"), call.get("arguments")
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except ValueError:
+                continue
+        if isinstance(step, int) and 1 <= step <= count and isinstance(arguments, dict):
+            if step in seen:
+                # Which of the calls is meant is unknown, the step is retried on its own
+                duplicates.add(step)
+            seen.add(step)
+            calls[step - 1] = (call.get("name"), arguments)
+    for step in duplicates:
+        calls[step - 1] = None
+    return calls
+
+def translate_batch(actions, functions, socketio, client=openai, timeout=None, schemas=None):
+    """Translate several actions with a single request and return their code.
+
+    The actions are sent as numbered steps and the model returns one call
+    per step through ``BATCH_FUNCTION``. Every call is validated against the
+    schema of its function; the code of a step that is missing or invalid
+    is None so that it can be retried on its own.
+    """
+    if schemas is None:
+        schemas = functions
+    steps = "\n".join(f"{number}. {action}" for number, action in enumerate(actions, 1))
+    messages = [*PROMPT_PREFIX, {"role": "user", "content": "Translate each of the following steps into Chemspeed syntax, one call per step:\n" + steps}]
+    request_functions = [*schemas, batch_schema(schemas)]
+    prompt_tokens = count_tokens(messages, request_functions)
+    debug(socketio, f"Prompt: {prompt_tokens} tokens for {len(actions)} actions, {len(schemas)}/{len(functions)} function schemas")
+
+    with span("chat_completion_batch", socketio):
+        response = client.ChatCompletion.create(
+            model="gpt-4",
+            messages=messages,
+            functions=request_functions,
+            function_call={"name": BATCH_FUNCTION},
+            frequency_penalty=0,
+            presence_penalty=0,
+            request_timeout=timeout,
+        )
+    response_message = response["choices"][0]["message"]
+    record_usage(response, prompt_tokens)
+    debug(socketio, f"{response_message}, {type(response_message)}")
+
+    codes = []
+    for action, call in zip(actions, parse_batch(response_message, len(actions))):
+        try:
+            if call is None:
+                raise ValueError("no call returned")
+            codes.append(emit_function_code(schemas, *call))
+        except ValueError as e:
+            debug(socketio, f"Invalid batched translation of \"{action}\": {e}")
+            codes.append(None)
+    return codes
+
+def translate_actions(actions, functions, socketio, matched_functions, client=openai, timeout=None, fast_path=True, schemas=None):
+    """Translate ``actions`` with one batched request and return their code in order.
+
+    Actions translated by the rule-based fast path are not sent to the
+    model. Actions whose batched translation is invalid are retried one by
+    one with ``translate_action``.
+    """
+    codes = [None] * len(actions)
+    remaining = []
+    for position, (action, matched_function) in enumerate(zip(actions, matched_functions)):
+        if fast_path:
+            codes[position] = rule_based_code(action, functions, socketio, matched_function)
+            if codes[position] is not None:
+                continue
+        remaining.append(position)
+
+    if len(remaining) > 1:
+        batch_codes = translate_batch([actions[position] for position in remaining], functions, socketio, client, timeout, schemas)
+        for position, function_code in zip(remaining, batch_codes):
+            codes[position] = function_code
+    for position in remaining:
+        if codes[position] is None:
+            codes[position] = translate_action(actions[position], functions, socketio, matched_functions[position],
+                                               client, timeout, fast_path=False, schemas=schemas)
+    return codes
+
+def convert_action_to_function(action, functions, socketio, matched_function=None, client=openai, timeout=None, fast_path=True, stream=False, index=None, schemas=None):
+    with span("translate_action", socketio):
+        function_code = translate_action(action, functions, socketio, matched_function, client, timeout, fast_path, stream, index, schemas)
+    emit_result(socketio, action, function_code, None)
+    return function_code
+
+def emit_result(socketio, action, function_code, error):
+    """Emit the outcome of one action; ``action`` is None when the segmentation failed.
+
+    Emitters with a true ``compact`` attribute get a single ``action_result``
+    payload per action instead of ``correct_structured`` or
+    ``translation_failed`` and the free-text messages.
+    """
+    if getattr(socketio, "compact", False):
+        socketio.emit("action_result", {"action": action, "code": function_code, "error": None if error is None else str(error)})
+    elif error is not None:
+        if action is None:
+            socketio.emit("message", f"Segmentation failed: {error}")
+        else:
+            socketio.emit("message", f"Translation failed for \"{action}\": {error}")
+        socketio.emit("translation_failed", {"action": action, "error": str(error)})
+    elif function_code is not None:
         socketio.emit("correct_structured", function_code)
-    socketio.emit("message", response_message)
 
-def convert(prompt, socketio):
-    prompt_actions = segment(prompt, socketio)
-    print(prompt_actions, type(prompt_actions), len(prompt_actions))
-    for action in prompt_actions:
-        convert_action_to_function(action, functions, socketio)
-    
-    
-    
+def emit_in_order(pending, socketio, cancel=None, results=None):
+    """Emit the translations in ``pending``, a deque of (action, future) in step order.
+
+    The (action, code) pairs emitted are appended to ``results`` if given,
+    with None as the code of failed actions.
+    """
+    while pending and not (cancel is not None and cancel.is_set()):
+        action, future = pending.popleft()
+        try:
+            function_code, error = future.result(), None
+        except Exception as e:
+            function_code, error = None, e
+        # The job may have been cancelled while waiting for the translation
+        if cancel is not None and cancel.is_set():
+            break
+        emit_result(socketio, action, function_code, error)
+        if results is not None:
+            results.append((action, function_code))
+
+def convert_actions(prompt_actions, socketio, functions=None, concurrency=1, timeout=None, client=openai, fast_path=True, cancel=None,
+                    schema_top_k=None, schema_min_score=0.0, batch_size=1):
+    """Translate already segmented actions, see ``convert``.
+
+    Returns the (action, code) pairs emitted in step order, with None as
+    the code of failed actions.
+    """
+    if functions is None:
+        functions = get_registry().functions
+    results = []
+    matches = match_many(prompt_actions, functions, top_k=schema_top_k or 1)
+    matched_functions = [candidates[0][0] for candidates in matches]
+    schemas = None
+    if schema_top_k is not None:
+        schemas = select_schemas(matches, functions, schema_top_k, schema_min_score, matched_functions)
+    if batch_size > 1:
+        batches = [
+            (prompt_actions[start:start + batch_size], matched_functions[start:start + batch_size])
+            for start in range(0, len(prompt_actions), batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            pending = deque(
+                (actions, executor.submit(translate_actions, actions, functions, socketio, batch_functions, client, timeout, fast_path, schemas))
+                for actions, batch_functions in batches
+            )
+            while pending and not (cancel is not None and cancel.is_set()):
+                actions, future = pending.popleft()
+                try:
+                    codes, error = future.result(), None
+                except Exception as e:
+                    codes, error = [None] * len(actions), e
+                if cancel is not None and cancel.is_set():
+                    break
+                for action, function_code in zip(actions, codes):
+                    emit_result(socketio, action, function_code, error)
+                    results.append((action, function_code))
+            if cancel is not None and cancel.is_set():
+                executor.shutdown(cancel_futures=True)
+        return results
+    if concurrency <= 1:
+        for action, matched_function in zip(prompt_actions, matched_functions):
+            if cancel is not None and cancel.is_set():
+                break
+            try:
+                function_code = convert_action_to_function(action, functions, socketio, matched_function, client, timeout, fast_path, schemas=schemas)
+            except Exception as e:
+                # Reported like the failures of the concurrent path; the next actions are still translated
+                function_code = None
+                emit_result(socketio, action, None, e)
+            results.append((action, function_code))
+        return results
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque(
+            (action, executor.submit(translate_action, action, functions, socketio, matched_function, client, timeout, fast_path, schemas=schemas))
+            for action, matched_function in zip(prompt_actions, matched_functions)
+        )
+        # Emit in step order; later results wait until their predecessors are done
+        emit_in_order(pending, socketio, cancel, results)
+        if cancel is not None and cancel.is_set():
+            executor.shutdown(cancel_futures=True)
+    return results
+
+def convert(prompt, socketio, concurrency=1, timeout=None, client=openai, fast_path=True, stream=False, max_pending=None, cancel=None,
+            schema_top_k=None, schema_min_score=0.0, batch_size=1):
+    """Segment ``prompt`` and translate every action.
+
+    The output is emitted on ``socketio``, the Socket.IO server or any
+    other sink with an ``emit(event, data)`` method (see ``output_sink``).
+    Actions that fail are also reported on ``translation_failed``. Sinks
+    with a true ``compact`` attribute get one ``action_result`` payload per
+    action instead, see ``emit_result``.
+
+    With ``concurrency`` > 1 up to that many translations are in flight at
+    once on a thread pool. The generated code is still emitted on
+    ``correct_structured`` in the original step order. ``timeout`` is the
+    per-request timeout in seconds passed to the OpenAI client.
+    ``fast_path`` enables the rule-based extraction of the arguments.
+
+    With ``stream`` the segmentation is streamed and pipelined with the
+    translation: each action is queued for translation as soon as its line
+    arrives, at most ``max_pending`` actions wait in the queue, and partial
+    code is pushed on ``partial_structured``. Setting the ``cancel`` event
+    (e.g. when the client disconnects) stops the conversion.
+
+    With ``schema_top_k`` only the schemas of the ``schema_top_k`` best
+    matching functions scoring at least ``schema_min_score`` are sent to the
+    model instead of the whole catalog. Without streaming the selections of
+    all actions are merged, so every request of the procedure shares the
+    same prompt prefix.
+
+    With ``batch_size`` > 1 (and without streaming) the actions are
+    translated ``batch_size`` at a time with a single request each, see
+    ``translate_actions``.
+
+    The functions are those of the registry catalog at the start of the
+    conversion, so catalog changes apply from the next procedure on.
+
+    Returns the (action, code) pairs emitted in step order, with None as
+    the code of failed actions.
+    """
+    with span("convert", socketio):
+        functions = get_registry().functions
+        if stream:
+            def translate(index, action):
+                candidates = match_many([action], functions, top_k=schema_top_k or 1)[0]
+                matched_function = candidates[0][0]
+                schemas = None
+                if schema_top_k is not None:
+                    schemas = select_schemas(candidates, functions, schema_top_k, schema_min_score, [matched_function])
+                return translate_action(action, functions, socketio, matched_function, client, timeout, fast_path, True, index, schemas)
+
+            results = []
+
+            def on_result(index, action, function_code, error):
+                emit_result(socketio, action, function_code, error)
+                if action is not None:
+                    results.append((action, None if error is not None else function_code))
+
+            actions = segment_stream(prompt, socketio, client=client, timeout=timeout)
+            run_pipeline(actions, translate, on_result, max(concurrency, 1), max_pending, cancel)
+            return results
+
+        prompt_actions = segment(prompt, socketio, client=client, timeout=timeout)
+        logger.debug("%d actions: %s", len(prompt_actions), prompt_actions)
+        return convert_actions(prompt_actions, socketio, functions, concurrency, timeout, client, fast_path, cancel,
+                               schema_top_k, schema_min_score, batch_size)
+
 
 if __name__ == '__main__':
     procedure = [
@@ -239,7 +580,7 @@ Transfer 0.2 mL liquid from filtrate_well to hplc_port with needle 1.
     ]
     for prompt in procedure:
         print(f"# {prompt}")
-        convert(prompt)
+        convert(prompt, PrintSink())
         print()
 # result:
 """
@@ -0,0 +1,143 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from threading import Lock
+
+import openai
+
+from generate_chatgpt_func_call import convert, convert_actions, debug, segment
+
+# Procedure lines translated together: their actions and the code generated for each action
+Block = namedtuple("Block", ["lines", "actions", "codes"])
+
+
+def procedure_lines(text):
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def split_blocks(lines, results):
+    """Blocks of translated ``lines`` from their (action, code) results.
+
+    When there is one action per line, as in most procedures, every line is
+    its own block and can be reused on its own. Otherwise the actions
+    cannot be attributed to lines and the lines form a single block.
+    """
+    if not lines:
+        return []
+    if len(results) == len(lines):
+        return [Block((line,), [action], [code]) for line, (action, code) in zip(lines, results)]
+    return [Block(tuple(lines), [action for action, _ in results], [code for _, code in results])]
+
+
+def plan(blocks, lines):
+    """Diff ``lines`` against the previously translated ``blocks``.
+
+    Returns, in the order of ``lines``, the blocks whose lines are all
+    unchanged and still adjacent (reused as they are) and the lists of
+    changed or inserted lines to translate. Blocks with a failed action are
+    translated again.
+    """
+    old_lines = [line for block in blocks for line in block.lines]
+    new_position = {}
+    for tag, i1, i2, j1, _ in SequenceMatcher(None, old_lines, lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            new_position.update((i1 + k, j1 + k) for k in range(i2 - i1))
+
+    reused = {}
+    start = 0
+    for block in blocks:
+        positions = [new_position.get(i) for i in range(start, start + len(block.lines))]
+        start += len(block.lines)
+        if None in positions or None in block.codes:
+            continue
+        if positions == list(range(positions[0], positions[0] + len(positions))):
+            reused[positions[0]] = block
+
+    items = []
+    changed = []
+    j = 0
+    while j < len(lines):
+        if j in reused:
+            if changed:
+                items.append(changed)
+                changed = []
+            items.append(reused[j])
+            j += len(reused[j].lines)
+        else:
+            changed.append(lines[j])
+            j += 1
+    if changed:
+        items.append(changed)
+    return items
+
+
+class IncrementalTranslator:
+    """Retranslates only the lines of a procedure edited since its last translation.
+
+    The lines, actions and generated code of the last procedure of every
+    session (at most ``max_sessions``, least recently used first out) are
+    kept. On a resubmission only the changed runs of lines are segmented
+    and translated; the code of the other lines is reused. The output
+    starts with an ``output_layout`` event listing the code of every step,
+    None for the steps that follow on ``correct_structured``.
+    """
+
+    def __init__(self, max_sessions=256):
+        self.max_sessions = max_sessions
+        self.records = OrderedDict()
+        self._lock = Lock()
+
+    def forget(self, session):
+        with self._lock:
+            self.records.pop(session, None)
+
+    def _store(self, session, blocks):
+        with self._lock:
+            self.records[session] = blocks
+            self.records.move_to_end(session)
+            while len(self.records) > self.max_sessions:
+                self.records.popitem(last=False)
+
+    def translate(self, session, text, socketio, cancel=None, concurrency=1, timeout=None, client=openai, **options):
+        """Translate ``text`` for ``session``; ``options`` are passed on to ``convert``."""
+        lines = procedure_lines(text)
+        with self._lock:
+            blocks = self.records.get(session, [])
+        items = plan(blocks, lines)
+
+        if not any(isinstance(item, Block) for item in items):
+            socketio.emit("output_layout", {"code": []})
+            results = convert(text, socketio, concurrency=concurrency, timeout=timeout, client=client, cancel=cancel, **options)
+            new_blocks = split_blocks(lines, results)
+        else:
+            new_blocks = self._update(items, socketio, cancel, concurrency, timeout, client, options)
+        if not (cancel is not None and cancel.is_set()):
+            self._store(session, new_blocks)
+
+    def _update(self, items, socketio, cancel, concurrency, timeout, client, options):
+        changed = [item for item in items if not isinstance(item, Block)]
+        debug(socketio, f"Reusing {len(items) - len(changed)} unchanged blocks, translating {sum(map(len, changed))} changed lines")
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            segmented = list(executor.map(lambda run: segment("\n".join(run), socketio, client=client, timeout=timeout), changed))
+        # A cancelled job must not replace the layout of the job that follows it
+        if cancel is not None and cancel.is_set():
+            return []
+
+        actions = {id(run): run_actions for run, run_actions in zip(changed, segmented)}
+        layout = []
+        for item in items:
+            layout += item.codes if isinstance(item, Block) else [None] * len(actions[id(item)])
+        socketio.emit("output_layout", {"code": layout})
+
+        convert_options = {name: options[name] for name in ("fast_path", "schema_top_k", "schema_min_score", "batch_size") if name in options}
+        results = convert_actions([action for run in segmented for action in run], socketio, concurrency=concurrency,
+                                  timeout=timeout, client=client, cancel=cancel, **convert_options)
+        new_blocks = []
+        for item in items:
+            if isinstance(item, Block):
+                new_blocks.append(item)
+            else:
+                count = len(actions[id(item)])
+                new_blocks += split_blocks(item, results[:count])
+                results = results[count:]
+        return new_blocks
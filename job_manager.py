@@ -0,0 +1,135 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class RoomEmitter:
+    """Socket.IO emitter bound to the room of one session.
+
+    Passed to ``convert`` in place of the ``SocketIO`` object so that the
+    output of a job only reaches the session that submitted it. With
+    ``trace`` the timing spans of the job are sent to the session as well.
+    With ``compact`` every action is reported with a single ``action_result``
+    event instead of the free-text progress messages. Once ``cancel`` is
+    set only ``job_status`` events are sent, so that the late output of a
+    cancelled job does not mix with the output of the next job.
+    """
+
+    def __init__(self, socketio, room, job_id, trace=False, compact=False, cancel=None):
+        self.socketio = socketio
+        self.room = room
+        self.job_id = job_id
+        self.trace = trace
+        self.compact = compact
+        self.cancel = cancel
+        self.completed = 0
+
+    def emit(self, event, data=None):
+        if event != "job_status" and self.cancel is not None and self.cancel.is_set():
+            return
+        self.socketio.emit(event, data, to=self.room)
+        if event == "correct_structured" or (event == "action_result" and data["action"] is not None):
+            self.completed += 1
+            self.socketio.emit("job_progress", {"job": self.job_id, "completed": self.completed}, to=self.room)
+
+
+class Job:
+    def __init__(self, job_id, room, input, trace=False, compact=False):
+        self.id = job_id
+        self.room = room
+        self.input = input
+        self.trace = trace
+        self.compact = compact
+        self.cancel = Event()
+        self.status = "queued"
+        self.future = None
+
+
+class JobManager:
+    """Runs translation jobs on a bounded worker pool.
+
+    ``run(input, emitter, cancel)`` is called for every job on one of
+    ``max_workers`` threads. At most ``max_jobs_per_room`` jobs per session
+    and ``max_queued`` jobs overall may be queued or running at once;
+    further submissions raise ``QueueFull``. Status changes are emitted on
+    ``job_status`` to the room of the job.
+    """
+
+    def __init__(self, socketio, run, max_workers=4, max_queued=64, max_jobs_per_room=2):
+        self.socketio = socketio
+        self.run = run
+        self.max_queued = max_queued
+        self.max_jobs_per_room = max_jobs_per_room
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="translation")
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+
+    def _set_status(self, job, status, **details):
+        job.status = status
+        self.socketio.emit("job_status", {"job": job.id, "status": status, **details}, to=job.room)
+
+    def active_jobs(self, room=None):
+        with self._lock:
+            return [job for job in self.jobs.values() if room is None or job.room == room]
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(job.status == "queued" for job in self.jobs.values())
+
+    def submit(self, room, input, trace=False, compact=False):
+        """Queue a translation of ``input`` whose output goes to ``room``.
+
+        With ``trace`` the timing spans of the translation are sent to ``room``,
+        with ``compact`` its output uses the compact events of ``RoomEmitter``.
+        """
+        with self._lock:
+            if len(self.jobs) >= self.max_queued:
+                raise QueueFull("Too many translations are queued, please try again later.")
+            # Cancelled jobs are winding down and do not count against the session
+            if sum(job.room == room and not job.cancel.is_set() for job in self.jobs.values()) >= self.max_jobs_per_room:
+                raise QueueFull("Too many translations are running for this session.")
+            job = Job(next(self._ids), room, input, trace, compact)
+            self.jobs[job.id] = job
+            position = sum(other.status == "queued" for other in self.jobs.values())
+        self._set_status(job, "queued", position=position)
+        job.future = self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        try:
+            if job.cancel.is_set():
+                self._set_status(job, "cancelled")
+                return
+            self._set_status(job, "running")
+            self.run(job.input, RoomEmitter(self.socketio, job.room, job.id, job.trace, job.compact, job.cancel), job.cancel)
+        except Exception as e:
+            self._set_status(job, "failed", error=str(e))
+        else:
+            self._set_status(job, "cancelled" if job.cancel.is_set() else "done")
+        finally:
+            with self._lock:
+                self.jobs.pop(job.id, None)
+
+    def cancel(self, job_id, room=None):
+        """Cancel a job. With ``room`` only a job of that session is cancelled."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None or (room is not None and job.room != room):
+            return False
+        job.cancel.set()
+        return True
+
+    def cancel_room(self, room):
+        """Cancel every job of a session, e.g. when it disconnects."""
+        for job in self.active_jobs(room):
+            job.cancel.set()
+
+    def shutdown(self):
+        for job in self.active_jobs():
+            job.cancel.set()
+        self.executor.shutdown(wait=True)
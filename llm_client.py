@@ -0,0 +1,282 @@
+import json
+import random
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Condition, Lock
+
+import openai
+import openai.error
+
+import metrics
+
+# Errors worth retrying: rate limits, overload, timeouts and dropped connections
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+    openai.error.APIConnectionError,
+)
+
+
+def pooled_session(pool_size=16):
+    """``requests`` session keeping up to ``pool_size`` connections to the API alive."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500
+
+
+def retry_after(error):
+    """Delay in seconds requested by the Retry-After header of ``error``, or None."""
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def estimate_tokens(request):
+    """Tokens a request counts against the rate limit: the prompt plus ``max_tokens``."""
+    prompt = request.get("messages") or request.get("prompt") or ""
+    text = json.dumps(prompt) + json.dumps(request.get("functions") or [])
+    return len(text) // 4 + (request.get("max_tokens") or 0)
+
+
+class AdaptiveLimit:
+    """Concurrency limit adjusted with additive increase / multiplicative decrease.
+
+    Every successful request raises the limit by ``1 / limit`` (about one
+    per round of requests); a rate-limit response halves it, at most once
+    per ``cooldown`` seconds so a burst of 429s counts as a single signal.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, cooldown=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._decreased = 0.0
+        self._condition = Condition()
+
+    def acquire(self, block=True):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                if not block:
+                    return False
+                self._condition.wait()
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_rate_limit(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._decreased >= self.cooldown:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._decreased = now
+
+
+class TokenBucket:
+    """Token budget refilled at ``tokens_per_minute``, holding at most one minute of tokens."""
+
+    def __init__(self, tokens_per_minute):
+        if not tokens_per_minute > 0:
+            raise ValueError(f"tokens_per_minute must be > 0, got {tokens_per_minute}")
+        self.rate = tokens_per_minute / 60
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def take(self, tokens):
+        """Wait until ``tokens`` are available and consume them."""
+        # A request larger than the bucket would never fit; let it drain the bucket instead
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class HeldStream:
+    """Stream of chunks holding a concurrency slot until it is exhausted or closed."""
+
+    def __init__(self, chunks, release):
+        self._chunks = iter(chunks)
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._release is None:
+            raise StopIteration
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            try:
+                getattr(self._chunks, "close", lambda: None)()
+            finally:
+                release()
+
+    def __del__(self):
+        self.close()
+
+
+class _ResilientEndpoint:
+    def __init__(self, kind, endpoint, client):
+        self.kind = kind
+        self.endpoint = endpoint
+        self.client = client
+
+    def create(self, **kwargs):
+        return self.client.request(self.kind, self.endpoint, kwargs)
+
+
+class ResilientClient:
+    """Drop-in replacement for the ``openai`` module for sustained load.
+
+    - requests go through one pooled keep-alive ``requests`` session,
+    - retryable errors are retried up to ``max_retries`` times with
+      exponential backoff and jitter, waiting at least Retry-After,
+    - the requests in flight are capped by an ``AdaptiveLimit`` that
+      shrinks on rate-limit responses and grows back on successes,
+    - ``tokens_per_minute`` maps a model (or engine) to a ``TokenBucket``
+      budget requests wait for before being sent,
+    - with ``hedge`` a non-streamed request still pending after the
+      ``hedge_quantile`` of the recent latencies of its endpoint and model
+      is sent a second time if the limit allows it, and the first response
+      wins.
+
+    Usage: ``convert(prompt, socketio, client=ResilientClient(openai))``
+    """
+
+    def __init__(self, client=openai, max_concurrency=16, initial_concurrency=4, max_retries=5, backoff=0.5,
+                 max_backoff=30.0, timeout=60.0, tokens_per_minute=None, hedge=True, hedge_quantile=0.95):
+        self.client = client
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.limit = AdaptiveLimit(initial_concurrency, 1, max_concurrency)
+        self.buckets = {model: TokenBucket(rate) for model, rate in (tokens_per_minute or {}).items()}
+        # Recent latencies per (endpoint kind, model or engine); the requests of a kind and model are alike
+        self._latencies = defaultdict(lambda: deque(maxlen=200))
+        self._hedges = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-request")
+        if client is openai:
+            # Shared by all threads instead of one session (and connection) per thread
+            openai.requestssession = pooled_session(max_concurrency)
+        self.Completion = _ResilientEndpoint("completion", client.Completion, self)
+        self.ChatCompletion = _ResilientEndpoint("chat_completion", client.ChatCompletion, self)
+
+    def hedge_delay(self, key):
+        """Latency after which a request of ``key`` is hedged, None until enough of its requests were seen."""
+        if not self.hedge or len(self._latencies.get(key, ())) < 20:
+            return None
+        latencies = sorted(self._latencies[key])
+        return latencies[int(self.hedge_quantile * (len(latencies) - 1))]
+
+    def _send(self, key, endpoint, kwargs):
+        """One attempt, holding a concurrency slot. The slot must already be acquired."""
+        start = time.monotonic()
+        try:
+            response = endpoint.create(**kwargs)
+        except openai.error.RateLimitError:
+            self.limit.on_rate_limit()
+            self.limit.release()
+            raise
+        except BaseException:
+            self.limit.release()
+            raise
+        self.limit.on_success()
+        if kwargs.get("stream"):
+            # The chunks are still being received, so the slot is freed once the stream is consumed
+            return HeldStream(response, self.limit.release)
+        self.limit.release()
+        self._latencies[key].append(time.monotonic() - start)
+        return response
+
+    def _attempt(self, key, endpoint, kwargs):
+        self.limit.acquire()
+        delay = self.hedge_delay(key)
+        if kwargs.get("stream") or delay is None:
+            return self._send(key, endpoint, kwargs)
+        first = self._hedges.submit(self._send, key, endpoint, kwargs)
+        done, _ = wait([first], timeout=delay)
+        if done or not self.limit.acquire(block=False):
+            return first.result()
+        metrics.inc("llm_hedged_requests")
+        second = self._hedges.submit(self._send, key, endpoint, kwargs)
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [future for future in done if future.exception() is None]
+            if succeeded or not pending:
+                # The slower request finishes in the background and frees its slot then
+                return (succeeded or list(done))[0].result()
+
+    def request(self, kind, endpoint, kwargs):
+        if kwargs.get("request_timeout") is None:
+            kwargs["request_timeout"] = self.timeout
+        model = kwargs.get("model") or kwargs.get("engine")
+        bucket = self.buckets.get(model)
+        if bucket is not None:
+            bucket.take(estimate_tokens(kwargs))
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._attempt((kind, model), endpoint, kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1)
+                delay = max(delay, retry_after(e) or 0)
+                metrics.inc("llm_retries", endpoint=kind, error=type(e).__name__)
+                time.sleep(delay)
+
+
+def parse_token_budgets(value):
+    """Parse a ``model=tokens,model=tokens`` list of tokens per minute."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        model, tokens = item.split("=")
+        if not float(tokens) > 0:
+            raise ValueError(f"{model.strip()}: tokens per minute must be > 0, got {tokens.strip()}")
+        budgets[model.strip()] = float(tokens)
+    return budgets
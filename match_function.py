@@ -1,188 +1,207 @@
-import spacy
+import numpy as np
+from collections import namedtuple
 from functools import lru_cache
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-
-# Function data
-functions = [
-        {
-            "name": "prime_pumps",
-            "description": "Primes the ChemSpeed pumps.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "pump": {
-                        "type": "integer",
-                        "description": "pump being primed",
-                    },
-                    "volume": {
-                        "type": "number",
-                        "description": "volume with which to prime pumps"},
-                },
-                "required": ["pump", "volume"],
-            },
-        },
-        {
-            "name": "transfer_liquid",
-            "description": "Executes a liquid transfer from the source to the target zone.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "source": {
-                        "type": "string",
-                        "description": "Source zone for the liquid transfer."
-                    },
-                    "destination": {
-                        "type": "string",
-                        "description": "Destination zone for the liquid transfer."
-                    },
-                    "volume": {
-                        "type": "number",
-                        "description": "Volume to transfer [mL]"
-                    },
-                    "needle": {
-                        "type": "integer",
-                        "description": "Number of the needle to use (0 means all needles)."
-                    },
-                },
-                "required": ["source", "destination", "volume", "needle"],
-            },
-        },
-        {
-            "name": "transfer_solid",
-            "description": "Executes a solid transfer from the source to the target destination.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "source": {
-                        "type": "string",
-                        "description": "Source zone for the solid transfer."
-                    },
-                    "destination": {
-                        "type": "string",
-                        "description": "Destination zone for the solid transfer."
-                    },
-                    "weight": {
-                        "type": "number",
-                        "description": "Mass to dispense [mg]"
-                    },
-                },
-                "required": ["source", "destination", "weight"],
-            },
-        },
-        {
-            "name": "do_schlenk_cycles",
-            "description": "Performs Schlenk Cycles (evacuate-refill cycles) on the specified wells.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "wells": {
-                        "type": "string",
-                        "description": "Zones to be set to inert gas."
-                    },
-                    "evac_time": {
-                        "type": "integer",
-                        "description": "Time (in sec) for evacuation. Default: 60 sec."
-                    },
-                    "backfill_time": {
-                        "type": "integer",
-                        "description": "Time (in sec) for backfilling with inert gas. Default: 30 sec."
-                    },
-                },
-                "required": ["wells"],
-            },
-        },
-        {
-            "name": "heat_under_reflux",
-            "description": "Sets up the heating and the reflux condenser for a specified time period. Cools the system back to room temperature for a specified cooling period.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "wells": {
-                        "type": "string",
-                        "description": "wells to be heated under reflux."
-                    },
-                    "stir_rate": {
-                        "type": "number",
-                        "description": "Stir rate (in rpm)"
-                    },
-                    "temperature": {
-                        "type": "number",
-                        "description": "Heating temperature (in °C)"
-                    },
-                    "heating_hours": {
-                        "type": "integer",
-                        "description": "Heating time (in h)"
-                    },
-                    "cooling_hours": {
-                        "type": "integer",
-                        "description": "Cooling time (in h)"
-                    },
-                    "condenser_temperature": {
-                        "type": "number",
-                        "description": "Temperature (in °C) of the reflux condenser."
-                    },
-                },
-                "required": ["wells", "stir_rate", "temperature", "heating_hours", "cooling_hours"],
-            },
-        },
-        {
-            "name": "filter_liquid",
-            "description": "Filters a liquid sample on a filtration rack. Allows for collecting the filtrate, washing and eluting the filter.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "source_well": {
-                        "type": "string",
-                        "description": "Source well of the sample to be filtered."
-                    },
-                    "filtration_zone": {
-                        "type": "string",
-                        "description": "Zone on the filtration rack to be used."
-                    },
-                    "filtration_volume": {
-                        "type": "number",
-                        "description": "Volume (in mL) of liquid to be filtered."
-                    },
-                },
-                "required": ["source_well", "filtration_zone", "filtration_volume"],
-            },
-        },
-    ]
+from threading import Lock, Thread
+
+from metrics import span
+
+# Pipeline components not needed for lemmatization and stop words
+EXCLUDED_COMPONENTS = ["parser", "senter", "ner"]
+
+_load_lock = Lock()
 
 @lru_cache(maxsize=None)
 def load_spacy_model():
-    return spacy.load("en_core_web_sm")
+    # spaCy is imported here so that importing this module stays cheap
+    import spacy
+    return spacy.load("en_core_web_sm", exclude=EXCLUDED_COMPONENTS)
 
-# Load the English language model
-nlp = load_spacy_model()
+def get_nlp():
+    """Return the English language model, loading it on first use."""
+    with _load_lock:
+        return load_spacy_model()
 
-def preprocess_text(text):
-    doc = nlp(text.lower())  # Convert to lowercase and tokenize the text
+def __getattr__(name):
+    # Keep ``match_function.nlp`` and ``match_function.functions`` working while loading them lazily
+    if name == "nlp":
+        return get_nlp()
+    if name == "functions":
+        from function_registry import get_registry
+        return get_registry().functions
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _lemmas(doc):
     return " ".join([token.lemma_ for token in doc if not token.is_stop and not token.is_punct])
 
+def preprocess_text(text):
+    with span("preprocess"):
+        doc = get_nlp()(text.lower())  # Convert to lowercase and tokenize the text
+        return _lemmas(doc)
+
+def preprocess_texts(texts, batch_size=256):
+    """Batched version of ``preprocess_text`` running the texts through ``nlp.pipe``."""
+    with span("preprocess_many"):
+        return [_lemmas(doc) for doc in get_nlp().pipe((text.lower() for text in texts), batch_size=batch_size)]
+
+TfidfIndex = namedtuple("TfidfIndex", ["key", "names", "vectorizer", "description_matrix", "dense"], defaults=[None])
+
+class FunctionMatcher:
+    """TF-IDF index over the function descriptions.
+
+    The descriptions are lemmatized and vectorized once; matching an
+    instruction only transforms the instruction. The index is rebuilt
+    whenever the names or descriptions of ``functions`` change, and is
+    replaced as a whole so concurrent matches never see a partial rebuild.
+
+    With an ``embedder`` (see ``vector_index.SpacyEmbedder``) a dense
+    ``VectorIndex`` of the functions is built as well, and the cosine
+    similarities of both are fused: ``dense_weight`` of the (non-negative)
+    dense similarity plus the rest of the TF-IDF similarity.
+    """
+
+    def __init__(self, functions=None, embedder=None, dense_weight=0.5, cache_dir=None):
+        self.index = None
+        self.embedder = embedder
+        self.dense_weight = dense_weight
+        self.cache_dir = cache_dir
+        self._lock = Lock()
+        if functions is not None:
+            self.fit(functions)
+
+    @property
+    def names(self):
+        return self.index.names if self.index is not None else []
+
+    @staticmethod
+    def catalog_key(functions):
+        return tuple((func["name"], func["description"]) for func in functions)
+
+    def fit(self, functions):
+        """Build the index for ``functions``."""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        key = self.catalog_key(functions)
+        processed_descriptions = preprocess_texts([description for _, description in key])
+        vectorizer = TfidfVectorizer()
+        description_matrix = vectorizer.fit_transform(processed_descriptions)
+        dense = None
+        if self.embedder is not None:
+            from vector_index import DEFAULT_CACHE_DIR, VectorIndex
+            dense = VectorIndex.build(functions, self.embedder, self.cache_dir or DEFAULT_CACHE_DIR)
+        self.index = TfidfIndex(key, [name for name, _ in key], vectorizer, description_matrix, dense)
+        return self
+
+    def configure_dense(self, embedder, dense_weight=0.5, cache_dir=None):
+        """Fuse the TF-IDF scores with those of ``embedder`` (None to turn it off)."""
+        with self._lock:
+            self.embedder = embedder
+            self.dense_weight = dense_weight
+            self.cache_dir = cache_dir
+            self.index = None
+
+    def _fuse(self, index, scores, texts):
+        if index.dense is None:
+            return scores
+        with span("match_dense"):
+            dense_scores = np.clip(index.dense.score_matrix(texts), 0, None)
+        return (1 - self.dense_weight) * scores + self.dense_weight * dense_scores
+
+    def ensure_fitted(self, functions):
+        """Rebuild the index if ``functions`` differs from the indexed catalog and return it."""
+        key = self.catalog_key(functions)
+        index = self.index
+        if index is None or index.key != key:
+            with self._lock:
+                if self.index is None or self.index.key != key:
+                    self.fit(functions)
+                index = self.index
+        return index
+
+    def scores(self, instruction, functions):
+        """Cosine similarity of ``instruction`` against every function description."""
+        return self._scores(self.ensure_fitted(functions), instruction)
+
+    def _scores(self, index, instruction):
+        instruction_vector = index.vectorizer.transform([preprocess_text(instruction)])
+        scores = (instruction_vector @ index.description_matrix.T).toarray()
+        return self._fuse(index, scores, [instruction]).ravel()
+
+    def match(self, instruction, functions):
+        """Name of the best matching function for ``instruction``."""
+        index = self.ensure_fitted(functions)
+        return index.names[self._scores(index, instruction).argmax()]
+
+    def score_matrix(self, instructions, functions, batch_size=256):
+        """Instructions x functions cosine similarity matrix.
+
+        TF-IDF rows are L2-normalized, so a single sparse product of the
+        instruction matrix with the transposed description matrix gives
+        the cosine similarities of every pair.
+        """
+        return self._score_matrix(self.ensure_fitted(functions), instructions, batch_size)
+
+    def _score_matrix(self, index, instructions, batch_size):
+        instruction_matrix = index.vectorizer.transform(preprocess_texts(instructions, batch_size))
+        return self._fuse(index, (instruction_matrix @ index.description_matrix.T).toarray(), instructions)
+
+    def match_many(self, instructions, functions, top_k=None, batch_size=256):
+        """Rank the functions for every instruction.
+
+        Returns one list per instruction of ``(function name, score)`` pairs
+        sorted by decreasing score, truncated to ``top_k`` entries if given.
+        """
+        if not instructions:
+            return []
+        index = self.ensure_fitted(functions)
+        scores = self._score_matrix(index, instructions, batch_size)
+        ranking = np.argsort(-scores, axis=1, kind="stable")
+        if top_k is not None:
+            ranking = ranking[:, :top_k]
+        return [
+            [(index.names[j], float(row_scores[j])) for j in row_ranking]
+            for row_scores, row_ranking in zip(scores, ranking)
+        ]
+
+
+_matcher = FunctionMatcher()
+
+
+def get_matcher():
+    """Return the shared matcher instance."""
+    return _matcher
+
+
 def match_to_function(instruction, functions):
-    processed_instruction = preprocess_text(instruction)
+    with span("match"):
+        return _matcher.match(instruction, functions)
 
-    # Function descriptions
-    function_descriptions = [func["description"] for func in functions]
+def match_many(instructions, functions, top_k=None, batch_size=256):
+    """Match a whole procedure at once, see ``FunctionMatcher.match_many``."""
+    with span("match_many"):
+        return _matcher.match_many(instructions, functions, top_k=top_k, batch_size=batch_size)
 
-    # Preprocess the function descriptions
-    processed_descriptions = [preprocess_text(desc) for desc in function_descriptions]
+def warm_up(functions=None, background=True):
+    """Load the language model and build the function index ahead of the first match.
 
-    # Calculate the similarity using Cosine Similarity
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform([processed_instruction] + processed_descriptions)
-    cosine_similarities = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:]).flatten()
+    ``functions`` defaults to the catalog of the function registry. With
+    ``background`` this runs on a daemon thread which is returned.
+    """
+    if functions is None:
+        from function_registry import get_registry
+        functions = get_registry().functions
+    if not background:
+        _matcher.ensure_fitted(functions)
+        return None
+    thread = Thread(target=_matcher.ensure_fitted, args=(functions,), name="match-function-warm-up", daemon=True)
+    thread.start()
+    return thread
 
-    # Get the index of the best matching function
-    best_match_index = cosine_similarities.argmax()
-    best_match_function = functions[best_match_index]["name"]
-    
-    return best_match_function
 
 if __name__ == "__main__":
-    
+    from function_registry import get_registry
+
+    functions = get_registry().functions
+
     # Define the instruction you want to match
     instructions = """Prime pump 1 with 30 mL using chemspd as manager.
 Transfer 10 mL of THF (liquid) from thf to internal_standard with needle 1.
@@ -198,9 +217,10 @@ Transfer 10 mL of internal standard (liquid) from internal_standard to rxn_well
 Filter 3 mL liquid sourced from rxn_well. Use filter_cartridge as filtration rack.
 Transfer 3.0 mL of THF (liquid) from thf into filter_cartridge with needle 1.
 Transfer 0.2 mL liquid from filtrate_well to hplc_port with needle 1."""
-    for instruction in instructions.split("\n"):
+    lines = instructions.split("\n")
+    # Rank the functions for all instructions in one batch
+    for instruction, candidates in zip(lines, match_many(lines, functions)):
         print(f"Instruction: {instruction}")
-        # Find the best matching function
-        best_match_function = match_to_function(instruction, functions)
+        best_match_function, score = candidates[0]
 
-        print(f"The best matching function is: {best_match_function}")
+        print(f"The best matching function is: {best_match_function} ({score:.3f})")
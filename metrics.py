@@ -0,0 +1,164 @@
+import time
+from threading import Lock
+
+PREFIX = "clairify_"
+
+# Upper bounds (in sec) of the stage duration histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+enabled = False
+
+_lock = Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+_levels = {}
+_help = {
+    "stage_seconds": "Duration of the pipeline stages.",
+    "tokens": "OpenAI tokens, counted from the response usage or estimated for streamed requests.",
+    "pipeline_queued_actions": "Segmented actions waiting for a translation worker.",
+}
+
+
+def enable(flag=True):
+    """Turn the collection of metrics on or off (off by default)."""
+    global enabled
+    enabled = flag
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to the counter ``name``."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record ``value`` in the histogram ``name``."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0, 0.0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += value
+
+
+def adjust(name, delta, **labels):
+    """Add ``delta`` (possibly negative) to the gauge ``name``."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _levels[key] = _levels.get(key, 0) + delta
+
+
+def register_gauge(name, description, collect):
+    """Report the value returned by ``collect()`` as the gauge ``name``.
+
+    ``collect`` may also return a dict mapping labels, as tuples of
+    (label, value) pairs, to values.
+    """
+    _gauges[name] = collect
+    _help[name] = description
+
+
+class _Span:
+    __slots__ = ("stage", "emitter", "start")
+
+    def __init__(self, stage, emitter):
+        self.stage = stage
+        self.emitter = emitter
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        observe("stage_seconds", duration, stage=self.stage)
+        if getattr(self.emitter, "trace", False):
+            self.emitter.emit("trace_span", {"stage": self.stage, "ms": round(duration * 1000, 3)})
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(stage, emitter=None):
+    """Context manager timing a pipeline stage.
+
+    The duration is recorded in the ``stage_seconds`` histogram and, if
+    ``emitter`` has a true ``trace`` attribute, emitted on ``trace_span``
+    for the per-request trace of the UI. When neither is enabled a shared
+    no-op context is returned.
+    """
+    if not enabled and not getattr(emitter, "trace", False):
+        return _NULL_SPAN
+    return _Span(stage, emitter)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+        levels = dict(_levels)
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {PREFIX}{name}_total {_help.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name}_total counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f"{PREFIX}{name}_total{_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {PREFIX}{name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (histogram, labels), value in sorted(histograms.items()):
+            if histogram != name:
+                continue
+            for bound, count in zip(BUCKETS, value):
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', '+Inf'),))} {value[-2]}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {value[-2]}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {value[-1]}")
+    for name in sorted({name for name, _ in levels}):
+        lines.append(f"# HELP {PREFIX}{name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        for (level, labels), value in sorted(levels.items()):
+            if level == name:
+                lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+    for name, collect in sorted(_gauges.items()):
+        lines.append(f"# HELP {PREFIX}{name} {_help[name]}")
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        value = collect()
+        for labels, sample in (value.items() if isinstance(value, dict) else [((), value)]):
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {sample}")
+    return "\n".join(lines) + "\n"
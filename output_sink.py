@@ -0,0 +1,44 @@
+import sys
+
+
+class PrintSink:
+    """Output sink printing the generated code, for command-line use.
+
+    ``convert`` and friends emit their output on an object with an
+    ``emit(event, data)`` method: the ``SocketIO`` server, a
+    ``RoomEmitter`` or one of the sinks of this module. With ``verbose``
+    the progress messages are printed too.
+    """
+
+    def __init__(self, file=None, verbose=False):
+        self.file = file or sys.stdout
+        self.verbose = verbose
+
+    def emit(self, event, data=None, **kwargs):
+        if event == "correct_structured":
+            print(data, file=self.file)
+        elif event == "translation_failed":
+            print(f"# Translation failed for \"{data['action']}\": {data['error']}", file=self.file)
+        elif event == "message" and self.verbose:
+            print(f"# {data}", file=self.file)
+
+
+class CollectSink:
+    """Output sink collecting the generated code and the failed actions of one procedure."""
+
+    def __init__(self):
+        self.code = []
+        self.errors = []
+
+    def emit(self, event, data=None, **kwargs):
+        if event == "correct_structured":
+            self.code.append(data)
+        elif event == "translation_failed":
+            self.errors.append(data)
+
+
+class NullSink:
+    """Output sink discarding everything."""
+
+    def emit(self, event, data=None, **kwargs):
+        pass
@@ -0,0 +1,99 @@
+from queue import Empty, Full, Queue
+from threading import Condition, Event, Thread
+
+import metrics
+
+# Interval (in sec) at which blocked threads check for cancellation
+POLL_INTERVAL = 0.1
+
+
+def _put(queue, item, cancel):
+    """Put ``item`` on ``queue``, blocking while it is full. False if cancelled."""
+    while not cancel.is_set():
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def run_pipeline(actions, translate, on_result, concurrency=1, max_pending=None, cancel=None):
+    """Translate ``actions`` while they are still being produced.
+
+    A producer thread reads ``actions`` (typically a streamed segmentation)
+    into a bounded queue that ``concurrency`` worker threads consume with
+    ``translate(index, action)``. Once the queue holds ``max_pending``
+    actions the producer blocks, which stops reading the segmentation
+    stream until the workers catch up. ``on_result(index, action, result,
+    error)`` is called from the calling thread in the original order.
+    Setting ``cancel`` stops the producer, the workers and the emission;
+    actions not yet translated are dropped.
+    """
+    cancel = cancel or Event()
+    queue = Queue(maxsize=max_pending or 2 * concurrency)
+    results = {}
+    produced = []
+    condition = Condition()
+
+    def produce():
+        count = 0
+        try:
+            for action in actions:
+                if not _put(queue, (count, action), cancel):
+                    break
+                metrics.adjust("pipeline_queued_actions", 1)
+                count += 1
+        except Exception as e:
+            with condition:
+                results[count] = (None, None, e)
+            count += 1
+        finally:
+            if hasattr(actions, "close"):
+                actions.close()
+            with condition:
+                produced.append(count)
+                condition.notify_all()
+            for _ in range(concurrency):
+                _put(queue, None, cancel)
+
+    def work():
+        while not cancel.is_set():
+            try:
+                item = queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+            if item is None:
+                return
+            metrics.adjust("pipeline_queued_actions", -1)
+            index, action = item
+            try:
+                result = (action, translate(index, action), None)
+            except Exception as e:
+                result = (action, None, e)
+            with condition:
+                results[index] = result
+                condition.notify_all()
+
+    threads = [Thread(target=produce, daemon=True)] + [Thread(target=work, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    next_index = 0
+    while not cancel.is_set():
+        with condition:
+            while next_index not in results and not (produced and next_index >= produced[0]) and not cancel.is_set():
+                condition.wait(POLL_INTERVAL)
+            if next_index not in results:
+                break
+            action, result, error = results.pop(next_index)
+        on_result(next_index, action, result, error)
+        next_index += 1
+
+    for thread in threads:
+        thread.join()
+    # Actions dropped on cancellation are no longer queued
+    while not queue.empty():
+        if queue.get_nowait() is not None:
+            metrics.adjust("pipeline_queued_actions", -1)
+    return next_index
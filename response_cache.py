@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import weakref
+from functools import partial
+from threading import Lock
+
+from openai.openai_object import OpenAIObject
+
+from code_emitter import InvalidCall, validate_call
+
+# Request arguments that do not influence the response
+TRANSPORT_ARGUMENTS = {"request_timeout", "api_key", "api_base", "organization", "stream"}
+
+
+def schema_hash(functions):
+    """Hash of a function schema list, used to invalidate cached responses."""
+    return hashlib.sha256(json.dumps(functions, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def request_key(kind, request):
+    """Content address of an OpenAI request.
+
+    The key covers the endpoint, the model, the prompt/messages, the hash of
+    the ``functions`` schema and the ``function_call`` target, so changing
+    any of them (in particular the schema) results in a cache miss.
+    """
+    request = {name: value for name, value in request.items() if name not in TRANSPORT_ARGUMENTS}
+    if "functions" in request:
+        request["functions"] = schema_hash(request["functions"])
+    payload = json.dumps({"kind": kind, "request": request}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _reopen_after_fork(reference):
+    cache = reference()
+    if cache is not None:
+        cache._lock = Lock()
+        cache._conn = sqlite3.connect(cache.path, check_same_thread=False)
+
+
+class ResponseCache:
+    """Persistent SQLite cache of OpenAI responses.
+
+    Entries expire after ``ttl`` seconds (never if None). When the stored
+    responses exceed ``max_bytes`` the least recently used entries are
+    evicted. A process forked with the cache open, such as a server worker
+    forked after preloading, reopens its own connection.
+    """
+
+    def __init__(self, path="response_cache.sqlite3", max_bytes=64 * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+        os.register_at_fork(after_in_child=partial(_reopen_after_fork, weakref.ref(self)))
+
+    def get(self, key):
+        """Return the cached value for ``key``, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[1] + self.ttl < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store ``value`` (JSON-serializable) under ``key``."""
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until the cache fits again
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters and the current size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def valid_response(kind, request, response):
+    """Whether the function call of a chat ``response`` matches the schemas of the ``request``.
+
+    Batched answers holding one call per step in a ``calls`` argument (see
+    ``generate_chatgpt_func_call.translate_batch``) are checked call by
+    call. Responses without a function call are valid.
+    """
+    if kind != "chat_completion":
+        return True
+    function_call = (response["choices"][0].get("message") or {}).get("function_call")
+    if not function_call:
+        return True
+    schemas = {func["name"]: func for func in request.get("functions") or []}
+    try:
+        calls = [(function_call.get("name"), json.loads(function_call.get("arguments") or ""))]
+        if isinstance(calls[0][1], dict) and isinstance(calls[0][1].get("calls"), list):
+            calls += [(call.get("name"), call.get("arguments")) for call in calls[0][1]["calls"] if isinstance(call, dict)]
+        for name, arguments in calls:
+            if isinstance(arguments, str):
+                arguments = json.loads(arguments)
+            if name not in schemas:
+                return False
+            validate_call(name, arguments, schemas[name])
+    except (InvalidCall, ValueError, TypeError):
+        return False
+    return True
+
+
+def _replay(kind, response):
+    """Turn a cached response into a single-chunk stream."""
+    choice = dict(response["choices"][0])
+    if kind == "chat_completion":
+        choice["delta"] = choice.pop("message")
+    yield OpenAIObject.construct_from({**response, "choices": [choice]})
+
+
+def _record(kind, chunks, on_complete):
+    """Pass a stream through and hand the assembled response to ``on_complete``."""
+    text = ""
+    message = {}
+    last = None
+    for chunk in chunks:
+        last = chunk
+        choice = chunk["choices"][0]
+        if kind == "chat_completion":
+            delta = choice.get("delta") or {}
+            if delta.get("role"):
+                message["role"] = delta["role"]
+            if delta.get("content"):
+                message["content"] = message.get("content", "") + delta["content"]
+            if delta.get("function_call"):
+                function_call = message.setdefault("function_call", {"name": "", "arguments": ""})
+                function_call["name"] += delta["function_call"].get("name") or ""
+                function_call["arguments"] += delta["function_call"].get("arguments") or ""
+        else:
+            text += choice.get("text") or ""
+        yield chunk
+    if last is None:
+        return
+    choice = {"index": 0, "finish_reason": last["choices"][0].get("finish_reason")}
+    if kind == "chat_completion":
+        choice["message"] = message
+    else:
+        choice["text"] = text
+    on_complete({"choices": [choice]})
+
+
+class _CachedEndpoint:
+    def __init__(self, kind, endpoint, cache):
+        self.kind = kind
+        self.endpoint = endpoint
+        self.cache = cache
+
+    def _store(self, key, request, response):
+        # An invalid call is retried by the next request instead of being replayed forever
+        if valid_response(self.kind, request, response):
+            self.cache.set(key, response)
+
+    def create(self, **kwargs):
+        key = request_key(self.kind, kwargs)
+        cached = self.cache.get(key)
+        if kwargs.get("stream"):
+            # Streams are replayed from the cache or recorded once fully consumed
+            if cached is not None:
+                return _replay(self.kind, cached)
+            return _record(self.kind, self.endpoint.create(**kwargs), lambda response: self._store(key, kwargs, response))
+        if cached is not None:
+            return OpenAIObject.construct_from(cached)
+        response = self.endpoint.create(**kwargs)
+        self._store(key, kwargs, response.to_dict_recursive())
+        return response
+
+
+class CachedClient:
+    """Drop-in replacement for the ``openai`` module that serves
+    ``Completion.create`` and ``ChatCompletion.create`` from a ``ResponseCache``.
+    Function calls that do not validate against the schemas of their
+    request are not cached.
+
+    Usage: ``convert(prompt, socketio, client=CachedClient(openai, cache))``
+    """
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self.Completion = _CachedEndpoint("completion", client.Completion, cache)
+        self.ChatCompletion = _CachedEndpoint("chat_completion", client.ChatCompletion, cache)
+
+
+def cache_from_env():
+    """Build the cache configured by the RESPONSE_CACHE_* environment variables.
+
+    Set RESPONSE_CACHE_PATH to an empty string to disable caching.
+    """
+    path = os.environ.get("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+    if not path:
+        return None
+    max_bytes = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    ttl = os.environ.get("RESPONSE_CACHE_TTL")
+    return ResponseCache(path, max_bytes=max_bytes, ttl=float(ttl) if ttl else None)
@@ -0,0 +1,189 @@
+import re
+
+from match_function import get_nlp
+
+# Words introducing the value of a zone argument, by argument name keyword
+ZONE_CUES = {
+    "source": ("from",),
+    "destination": ("to", "into"),
+    "well": ("on", "in"),
+}
+
+# Units accepted for a numeric argument, by argument name keyword
+NAME_UNITS = {
+    "volume": ("ml",),
+    "weight": ("mg",),
+    "mass": ("mg",),
+    "temperature": ("c", "°c", "°"),
+    "hours": ("h", "hour", "hours", "hr", "hrs"),
+    "evac": ("s", "sec", "secs", "second", "seconds"),
+    "backfill": ("s", "sec", "secs", "second", "seconds"),
+    "stir": ("rpm",),
+}
+
+# Units accepted for a numeric argument, by unit mentioned in its description
+DESCRIPTION_UNITS = {
+    "ml": ("ml",),
+    "mg": ("mg",),
+    "°c": ("c", "°c", "°"),
+    "h": ("h", "hour", "hours", "hr", "hrs"),
+    "sec": ("s", "sec", "secs", "second", "seconds"),
+    "rpm": ("rpm",),
+}
+
+# Negations, fractions and repetitions changing the meaning of the values; left to the LLM
+MODIFIERS = {
+    "not", "n't", "no", "never", "nor", "except", "without",
+    "half", "halves", "third", "thirds", "quarter", "quarters", "fraction", "percent", "%",
+    "twice", "thrice", "times", "each", "every", "per", "again", "repeat", "double", "triple",
+}
+
+# Name parts that are too generic to locate an argument in the text
+GENERIC_PARTS = {"time", "rate", "hours", "zone", "well", "wells"}
+
+IDENTIFIER = re.compile(r"^[a-z][a-z0-9_]*$")
+DESCRIPTION_UNIT = re.compile(r"(?:\[|\(in )([^\])]+)[\])]")
+WINDOW = 3
+
+
+def _units(name, prop):
+    match = DESCRIPTION_UNIT.search(prop.get("description", ""))
+    if match and match.group(1).lower() in DESCRIPTION_UNITS:
+        return DESCRIPTION_UNITS[match.group(1).lower()]
+    for keyword, units in NAME_UNITS.items():
+        if keyword in name:
+            return units
+    return ()
+
+
+def _keywords(name):
+    return [part[:4] for part in name.split("_") if part not in GENERIC_PARTS and len(part) >= 3]
+
+
+def _is_zone(token):
+    return bool(IDENTIFIER.match(token.text)) and not token.is_stop and not token.like_num
+
+
+def _number(text, type_):
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    if type_ == "integer":
+        return int(value) if value.is_integer() else None
+    return int(text) if text.isdigit() else value
+
+
+def _keyword_proximity(doc, i, keywords, units):
+    """Number of ``keywords`` within the window around token ``i`` and the
+    distance to the nearest one, not counting unit tokens and punctuation."""
+    distances = {}
+    for step in (-1, 1):
+        distance = 0
+        j = i + step
+        while 0 <= j < len(doc) and distance < WINDOW:
+            token = doc[j]
+            if token.lower_ not in units and not token.is_punct:
+                distance += 1
+                for keyword in keywords:
+                    if token.lower_.startswith(keyword):
+                        distances[keyword] = min(distance, distances.get(keyword, distance))
+            j += step
+    return len(distances), min(distances.values(), default=WINDOW)
+
+
+def _assign(candidates):
+    """Greedily assign tokens to arguments, best (score, distance) first.
+
+    Returns None if two arguments compete equally for the same token or one
+    argument equally for two tokens, as the assignment is then a guess.
+    """
+    assigned = {}
+    claims = {}
+    for score, distance, name, i in sorted(candidates):
+        if name in assigned and assigned[name][1] == (score, distance) and assigned[name][0] != i:
+            return None
+        if i in claims and claims[i][1] == (score, distance) and claims[i][0] != name:
+            return None
+        if name not in assigned and i not in claims:
+            assigned[name] = (i, (score, distance))
+            claims[i] = (name, (score, distance))
+    return {name: i for name, (i, _) in assigned.items()}
+
+
+def extract_arguments(action, function):
+    """Extract the arguments of ``function`` from ``action`` without the LLM.
+
+    Numbers are matched to numeric arguments by their unit and by words of
+    the argument name next to them; zones are matched to string arguments
+    by the prepositions preceding them. Returns the arguments in schema
+    order, or None if a required argument (or an optional one whose name
+    appears in the action) cannot be extracted confidently, if a number of
+    the action is left unassigned, or if the action contains a negation,
+    fraction or repetition word (see ``MODIFIERS``).
+    """
+    doc = get_nlp().make_doc(action)
+    if any(token.lower_ in MODIFIERS for token in doc):
+        return None
+    properties = function["parameters"]["properties"]
+    required = function["parameters"].get("required", [])
+    numbers = [token.i for token in doc if token.like_num]
+    zones = [token.i for token in doc if _is_zone(token)]
+    lowered = action.lower()
+
+    number_candidates = []
+    zone_candidates = []
+    for name, prop in properties.items():
+        keywords = _keywords(name)
+        if prop["type"] in ("number", "integer"):
+            units = _units(name, prop)
+            for i in numbers:
+                has_unit = i + 1 < len(doc) and doc[i + 1].lower_ in units
+                matched, distance = _keyword_proximity(doc, i, keywords, units)
+                if matched or has_unit:
+                    number_candidates.append((-matched - has_unit, distance, name, i))
+        else:
+            cues = next((cues for keyword, cues in ZONE_CUES.items() if keyword in name), ())
+            for i in zones:
+                previous = doc[i - 1] if i > 0 and doc[i - 1].lower_ != "the" else doc[i - 2] if i > 1 else None
+                if previous is not None and previous.lower_ in cues:
+                    zone_candidates.append((-2, 0, name, i))
+                    continue
+                # Without a cue only underscored zone names are trusted, e.g. "filter_cartridge"
+                matched, distance = _keyword_proximity(doc, i, keywords, ())
+                if matched and "_" in doc[i].text:
+                    zone_candidates.append((-1, distance, name, i))
+
+    # Every number must be claimed by at most one argument, likewise for zones
+    assigned_numbers = _assign(number_candidates)
+    assigned_zones = _assign(zone_candidates)
+    if assigned_numbers is None or assigned_zones is None:
+        return None
+    assigned = {**assigned_numbers, **assigned_zones}
+
+    # A required "wells" argument without a cue is the first zone of the action
+    for name in required:
+        if name not in assigned and "well" in name and properties[name]["type"] == "string":
+            free = [i for i in zones if i not in assigned.values()]
+            if free:
+                assigned[name] = free[0]
+
+    # A number no argument accounts for (e.g. "3 Schlenk cycles") would be silently dropped
+    if set(numbers) - set(assigned.values()):
+        return None
+
+    arguments = {}
+    for name, prop in properties.items():
+        if name not in assigned:
+            if name in required or any(keyword in lowered for keyword in _keywords(name)):
+                return None
+            continue
+        token = doc[assigned[name]]
+        if prop["type"] in ("number", "integer"):
+            value = _number(token.text, prop["type"])
+            if value is None:
+                return None
+        else:
+            value = token.text
+        arguments[name] = value
+    return arguments
@@ -0,0 +1,126 @@
+"""Production entry point of the web server, with several worker processes.
+
+The app is created and the spaCy model and function index are loaded once
+in the parent process, which then forks the workers; they share the loaded
+models copy-on-write and accept connections on the same listening socket.
+Workers share the Socket.IO sessions through a message queue and the
+browser connects over WebSocket only, so no sticky sessions are needed.
+A worker that exits is replaced.
+
+    python serve.py --workers 4 --async-mode eventlet --message-queue redis://127.0.0.1:6379/0
+    python serve.py --workers 2 --message-queue sqlite:///socketio_queue.sqlite3
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import traceback
+
+ASYNC_MODES = ["threading", "eventlet", "gevent"]
+
+
+def patch(async_mode):
+    """Monkey-patch the standard library for ``async_mode``; must run before the app is imported."""
+    if async_mode == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    elif async_mode == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def run(app, listener, async_mode):
+    """Serve ``app`` on the already bound ``listener`` until interrupted."""
+    if async_mode == "eventlet":
+        import eventlet.wsgi
+        eventlet.wsgi.server(listener, app, log_output=False)
+    elif async_mode == "gevent":
+        from gevent.pywsgi import WSGIServer
+        try:
+            from geventwebsocket.handler import WebSocketHandler
+        except ImportError:
+            # Without gevent-websocket the browser falls back to long-polling
+            WebSocketHandler = None
+        options = {"handler_class": WebSocketHandler} if WebSocketHandler is not None else {}
+        WSGIServer(listener, app, log=None, **options).serve_forever()
+    else:
+        from werkzeug.serving import make_server
+        host, port = listener.getsockname()[:2]
+        make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+
+
+def spawn(app, listener, async_mode):
+    """Fork a worker process serving ``app``; returns its pid."""
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    status = 0
+    try:
+        run(app, listener, async_mode)
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def stop(signum, frame):
+    raise SystemExit(0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    parser.add_argument("--async-mode", choices=ASYNC_MODES, default="threading")
+    parser.add_argument("--message-queue", help="Redis, RabbitMQ or Kafka URL, or sqlite:///path for a single host")
+    args = parser.parse_args(argv)
+    if args.workers > 1 and not args.message_queue:
+        parser.error("--workers > 1 needs a --message-queue shared by the workers")
+    if args.workers > 1 and args.message_queue.startswith("local://"):
+        parser.error("local:// only connects the servers of one process, use sqlite:/// instead")
+
+    patch(args.async_mode)
+    # Imported after patching so the app's modules get the patched standard library
+    from flask_webserver import create_app
+
+    app = create_app(args.async_mode, args.message_queue, preload=True, websocket_only=args.workers > 1)
+    listener = socket.create_server((args.host, args.port), backlog=1024)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} {args.async_mode} workers")
+    if args.workers == 1:
+        try:
+            run(app, listener, args.async_mode)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    workers = {spawn(app, listener, args.async_mode) for _ in range(args.workers)}
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            pid, status = os.wait()
+            workers.discard(pid)
+            print(f"Worker {pid} exited with status {status}, starting a new one", file=sys.stderr)
+            workers.add(spawn(app, listener, args.async_mode))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+
+if __name__ == "__main__":
+    main()
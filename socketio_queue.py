@@ -0,0 +1,116 @@
+import os
+import pickle
+import sqlite3
+import time
+from collections import defaultdict
+from queue import Queue
+from threading import Lock
+
+import socketio
+
+
+class SQLiteManager(socketio.PubSubManager):
+    """Socket.IO client manager passing messages between processes through a SQLite file.
+
+    Stands in for a Redis or RabbitMQ message queue when all the server
+    processes run on one host, e.g. in tests or small deployments. Every
+    process appends its messages to a table and polls it every
+    ``poll_interval`` seconds; messages older than ``retention`` seconds
+    are deleted.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, url="sqlite:///socketio_queue.sqlite3", channel="flask-socketio", write_only=False, logger=None,
+                 poll_interval=0.02, retention=60.0):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._lock = Lock()
+        self._conn = None
+        self._pid = None
+        self._purged = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, data BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        return conn
+
+    def _publish(self, data):
+        now = time.time()
+        with self._lock:
+            # A connection opened before a fork belongs to the parent process
+            if self._pid != os.getpid():
+                self._conn, self._pid = self._connect(), os.getpid()
+            self._conn.execute("INSERT INTO messages (channel, data, created) VALUES (?, ?, ?)",
+                               (self.channel, pickle.dumps(data), now))
+            if now - self._purged >= 1.0:
+                self._conn.execute("DELETE FROM messages WHERE created < ?", (now - self.retention,))
+                self._purged = now
+
+    def _listen(self):
+        conn = self._connect()
+        last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        while True:
+            rows = conn.execute("SELECT id, data FROM messages WHERE id > ? AND channel = ? ORDER BY id",
+                                (last, self.channel)).fetchall()
+            for last, data in rows:
+                yield pickle.loads(data)
+            if not rows:
+                self.server.sleep(self.poll_interval)
+
+
+class LocalManager(socketio.PubSubManager):
+    """Socket.IO client manager passing messages between the servers of one process.
+
+    Stands in for a message queue in tests running several Socket.IO
+    servers, e.g. one per simulated worker, in a single process. Messages
+    are copied through pickle like on the wire.
+    """
+
+    name = "local"
+
+    _subscribers = defaultdict(list)
+    _subscribers_lock = Lock()
+
+    def __init__(self, url="local://", channel="flask-socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._queue = Queue()
+        if not write_only:
+            with self._subscribers_lock:
+                self._subscribers[channel].append(self._queue)
+
+    def _publish(self, data):
+        message = pickle.dumps(data)
+        with self._subscribers_lock:
+            queues = list(self._subscribers[self.channel])
+        for queue in queues:
+            queue.put(pickle.loads(message))
+
+    def close(self):
+        """Stop receiving messages; the listening thread then exits."""
+        with self._subscribers_lock:
+            if self._queue in self._subscribers[self.channel]:
+                self._subscribers[self.channel].remove(self._queue)
+        self._queue.put(None)
+
+    def _listen(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            yield message
+
+
+def client_manager(url, channel="flask-socketio"):
+    """Client manager for the ``sqlite://`` and ``local://`` stand-ins, None for other message queue URLs."""
+    if url.startswith("sqlite://"):
+        return SQLiteManager(url, channel)
+    if url.startswith("local://"):
+        return LocalManager(url, channel)
+    return None
@@ -5,6 +5,7 @@
       button.value = "Running Translation...";
       tab2.click();
       output_structured.innerHTML = "";
+      output_partial.innerHTML = "";
     });
     
   }
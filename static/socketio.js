@@ -1,49 +1,124 @@
-const socketio = io();
+const socketio = io({transports: SOCKETIO_TRANSPORTS});
 
 const messages = document.getElementById("messages");
+const steps = document.getElementById("steps");
+const output = document.getElementById("output_structured");
 
-convertHTMLString = (msg) => {
-    for (char=0; char<msg.length; char++) {
-        if (msg[char] == "<") {
-            msg = msg.slice(0, char) + "&lt;" + msg.slice(char+1);
-        } else if (msg[char] == ">") {
-            msg = msg.slice(0, char) + "&gt;" + msg.slice(char+1);
+// Entries kept in each log pane, the oldest ones are dropped first
+const MAX_LOG_ENTRIES = 500;
+const paneLimits = new Map([[messages, MAX_LOG_ENTRIES], [steps, MAX_LOG_ENTRIES]]);
+
+// The server routes the output of a translation to the Socket.IO session submitting it
+socketio.on("connect", () => {
+    document.getElementById("sid").value = socketio.id;
+});
+
+socketio.on("session_token", (token) => {
+    document.getElementById("token").value = token;
+});
+
+// Submit over the connection so the job runs in the server process holding the session
+document.getElementById("input_form").addEventListener("submit", (event) => {
+    if (!socketio.connected) {
+        return;
+    }
+    event.preventDefault();
+    socketio.emit("translate", {
+        input: document.getElementById("input_field").value,
+        trace: document.getElementById("trace").checked,
+        verbose: document.getElementById("verbose").checked,
+    });
+});
+
+// Nodes waiting to be added to each pane; they are inserted together once per animation frame
+const queuedNodes = new Map();
+let frameRequested = false;
+
+const flushPanes = () => {
+    frameRequested = false;
+    for (const [pane, nodes] of queuedNodes) {
+        const atBottom = pane.scrollTop + pane.clientHeight >= pane.scrollHeight - 5;
+        const fragment = document.createDocumentFragment();
+        for (const node of nodes) {
+            fragment.appendChild(node);
+        }
+        pane.appendChild(fragment);
+        const limit = paneLimits.get(pane);
+        while (limit !== undefined && pane.childElementCount > limit) {
+            pane.firstElementChild.remove();
         }
+        if (atBottom) {
+            pane.scrollTop = pane.scrollHeight;
+        }
+    }
+    queuedNodes.clear();
+};
+
+const appendToPane = (pane, node) => {
+    let nodes = queuedNodes.get(pane);
+    if (!nodes) {
+        nodes = [];
+        queuedNodes.set(pane, nodes);
+    }
+    nodes.push(node);
+    // Frames are paused in background tabs; do not let a capped pane's queue grow meanwhile
+    const limit = paneLimits.get(pane);
+    if (limit !== undefined && nodes.length > 2 * limit) {
+        nodes.splice(0, nodes.length - limit);
     }
-    return msg;
-}
+    if (!frameRequested) {
+        frameRequested = true;
+        requestAnimationFrame(flushPanes);
+    }
+};
+
+const logEntry = (tag, text) => {
+    const entry = document.createElement("div");
+    entry.className = "text";
+    const content = document.createElement(tag);
+    content.style.fontSize = "0.7rem";
+    content.textContent = text;
+    entry.appendChild(content);
+    return entry;
+};
 
 const createMessage = (msg) => {
-    console.log(msg)
-    
-    const content = `
-    <div class="text">
-        <span style="font-size: 0.7rem;">
-            ${msg}
-        </span>
-    </div>
-    <lbr>
-    `;
-    messages.innerHTML += content;
+    appendToPane(messages, logEntry("span", msg));
 };
 
 createStructuredMessage = (msg) => {
-    const content = `
-    <div class="text">
-        <pre style="font-size: 0.7rem;">
-            ${convertHTMLString(msg)}
-        </pre>
-    </div>
-    <lbr>`;
-    messages.innerHTML += content;
-    
+    appendToPane(steps, logEntry("pre", msg));
 };
 
-const output = document.getElementById("output_structured")
+// Placeholders of the steps whose code is still to come after an output_layout
+let pendingSteps = [];
+
+const removePendingSteps = (count = pendingSteps.length) => {
+    for (const step of pendingSteps.splice(0, count)) {
+        step.nextElementSibling?.remove();
+        step.remove();
+    }
+};
+
+const codeLine = (code) => {
+    const line = document.createElement("div");
+    if (code === null) {
+        line.className = "pending_step";
+    } else {
+        line.textContent = code;
+    }
+    return line;
+};
 
 createCorrectStructuredMessage = (msg) => {
-    output.innerHTML += `<div>${convertHTMLString(msg)}</div>`;
-    output.innerHTML += "<br>";
+    const pending = pendingSteps.shift();
+    if (pending) {
+        pending.textContent = msg;
+        pending.className = "";
+        return;
+    }
+    appendToPane(output, codeLine(msg));
+    appendToPane(output, document.createElement("br"));
     // Prism.highlightAll();    
 };
 
@@ -55,13 +130,114 @@ socketio.on("message_structured", (msg) => {
     createStructuredMessage(msg);
 });
 
+const partial = document.getElementById("output_partial");
+const partialLines = {};
+
+createPartialMessage = (msg) => {
+    // Code of a step still being generated, replaced on every update and removed once done
+    let line = partialLines[msg.index];
+    if (msg.done) {
+        if (line) {
+            line.remove();
+            delete partialLines[msg.index];
+        }
+        return;
+    }
+    if (!line) {
+        line = document.createElement("div");
+        partialLines[msg.index] = line;
+        partial.appendChild(line);
+    }
+    line.textContent = msg.code;
+};
+
+socketio.on("partial_structured", (msg) => {
+    createPartialMessage(msg);
+});
+
 const tab = document.getElementById("defaultOpen");
 
+const showOutput = () => {
+    if (!tab.classList.contains("active")) {
+        tab.click();
+    }
+};
+
+socketio.on("output_layout", (msg) => {
+    // Code reused from the previous translation, with a placeholder for every step retranslated
+    queuedNodes.delete(output);
+    const fragment = document.createDocumentFragment();
+    pendingSteps = [];
+    for (const code of msg.code) {
+        const line = codeLine(code);
+        if (code === null) {
+            pendingSteps.push(line);
+        }
+        fragment.appendChild(line);
+        fragment.appendChild(document.createElement("br"));
+    }
+    output.replaceChildren(fragment);
+});
+
+socketio.on("translation_failed", (msg) => {
+    if (msg.action !== null) {
+        removePendingSteps(1);
+    }
+});
+
 socketio.on("correct_structured", (msg) => {
     createCorrectStructuredMessage(msg);
-    tab.click();
+    showOutput();
+});
+
+// Compact output: one payload per action instead of the free-text messages
+socketio.on("action_result", (msg) => {
+    if (msg.code !== null) {
+        createCorrectStructuredMessage(msg.code);
+        showOutput();
+    } else if (msg.action !== null) {
+        removePendingSteps(1);
+    }
+    if (msg.action === null) {
+        createStructuredMessage(`Segmentation failed: ${msg.error}`);
+    } else if (msg.code !== null) {
+        createStructuredMessage(`${msg.action}\n${msg.code}`);
+    } else {
+        createStructuredMessage(`${msg.action}\nTranslation failed: ${msg.error}`);
+    }
+});
+
+const resetButton = () => {
     if (button.value != "Translate") {
         button.value = "Translate";
         button.disabled = false;
     }
-});
\ No newline at end of file
+};
+
+// Latest job of this page; a job it replaced may still report its status
+let currentJob = null;
+
+socketio.on("job_status", (msg) => {
+    if (msg.status == "queued") {
+        currentJob = msg.job;
+        button.value = `Queued (position ${msg.position})...`;
+    } else if (msg.job !== null && msg.job !== currentJob) {
+        return;
+    } else if (msg.status == "running") {
+        button.value = "Running Translation...";
+    } else {
+        if (msg.error) {
+            createMessage(`Translation ${msg.status}: ${msg.error}`);
+        }
+        removePendingSteps();
+        resetButton();
+    }
+});
+
+socketio.on("trace_span", (msg) => {
+    createMessage(`[trace] ${msg.stage}: ${msg.ms.toFixed(1)} ms`);
+});
+
+socketio.on("job_progress", (msg) => {
+    button.value = `Running Translation... (${msg.completed} done)`;
+});
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+
+@pytest.fixture(scope="session")
+def nlp():
+    """The spaCy model used for matching; tests needing it are skipped when it is not installed."""
+    from match_function import get_nlp
+
+    try:
+        return get_nlp()
+    except (ImportError, OSError) as e:
+        pytest.skip(f"spaCy model unavailable: {e}")
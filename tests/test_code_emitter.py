@@ -0,0 +1,78 @@
+import pytest
+
+from code_emitter import InvalidCall, coerce_value, emit_call, render_call, validate_call
+
+SCHEMA = {
+    "name": "prime_pumps",
+    "description": "Primes a pump with a volume of solvent.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "pump": {"type": "integer"},
+            "volume": {"type": "number"},
+            "source": {"type": "string"},
+            "wait": {"type": "boolean"},
+            "mode": {"type": "string", "enum": ["fast", "slow"]},
+        },
+        "required": ["pump", "volume"],
+    },
+}
+
+
+@pytest.mark.parametrize("value, schema, expected", [
+    ("30", {"type": "integer"}, 30),
+    (" 2.0 ", {"type": "integer"}, 2),
+    (3.0, {"type": "integer"}, 3),
+    ("30", {"type": "number"}, 30),
+    ("1.5", {"type": "number"}, 1.5),
+    ("True", {"type": "boolean"}, True),
+    (" false", {"type": "boolean"}, False),
+    ("'thf'", {"type": "string"}, "thf"),
+    (1, {"type": "string"}, "1"),
+])
+def test_values_are_coerced(value, schema, expected):
+    coerced = coerce_value(value, schema)
+    assert coerced == expected and type(coerced) is type(expected)
+
+
+@pytest.mark.parametrize("value, schema", [
+    ("2.5", {"type": "integer"}),
+    (True, {"type": "integer"}),
+    (False, {"type": "number"}),
+    ("thirty", {"type": "number"}),
+    ("yes", {"type": "boolean"}),
+])
+def test_values_that_cannot_be_coerced_are_rejected(value, schema):
+    with pytest.raises(ValueError):
+        coerce_value(value, schema)
+
+
+def test_valid_call_is_coerced_and_rendered():
+    assert emit_call("prime_pumps", {"pump": "1", "volume": "30", "source": '"thf"'}, SCHEMA, routine=True) == \
+        "routines.prime_pumps(chmspd=chmspd, pump=1, volume=30, source=thf)"
+    assert emit_call("prime_pumps", {"pump": 1, "volume": 2.5, "source": "vial 1", "wait": "false"}, SCHEMA) == \
+        "chemspd.prime_pumps(pump=1, volume=2.5, source='vial 1', wait=False)"
+
+
+@pytest.mark.parametrize("arguments, error", [
+    ({"pump": "1", "volume": "30", "manager": "chemspd"}, "manager: unknown argument"),
+    ({"pump": "1", "volume": "30", "bad key": 1}, "bad key: unknown argument"),
+    ({"pump": "one", "volume": "30"}, "pump:"),
+    ({"pump": "1"}, "'volume' is a required property"),
+    ({"pump": "1", "volume": "30", "mode": "medium"}, "'medium' is not one of"),
+    (["1", "30"], "is not an object"),
+])
+def test_invalid_calls_are_rejected(arguments, error):
+    with pytest.raises(InvalidCall, match=error):
+        validate_call("prime_pumps", arguments, SCHEMA)
+
+
+@pytest.mark.parametrize("name", ["class", "bad key"])
+def test_parameters_that_are_not_python_names_are_rejected(name):
+    schema = {"name": "transfer_liquid", "parameters": {"type": "object", "properties": {name: {"type": "string"}}}}
+    with pytest.raises(InvalidCall, match="not a valid argument name"):
+        emit_call("transfer_liquid", {name: "x"}, schema)
+
+
+def test_render_keeps_every_argument():
+    assert render_call("stir", {"speed": 600, "zone": "rxn_well"}) == "chemspd.stir(speed=600, zone=rxn_well)"
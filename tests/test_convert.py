@@ -0,0 +1,195 @@
+import json
+import re
+import time
+from threading import Event
+
+import pytest
+
+from generate_chatgpt_func_call import BATCH_FUNCTION, convert, parse_batch
+from incremental import IncrementalTranslator
+from output_sink import CollectSink
+from stub_client import StubClient
+
+PROCEDURE = "\n".join(f"Transfer {number} mL of THF from thf to rxn_well with needle 1." for number in range(1, 13))
+
+
+class EchoClient(StubClient):
+    """Stub answering with the number of the action as the volume, so the order of the codes shows."""
+
+    def __init__(self, fail=(), **kwargs):
+        super().__init__(**kwargs)
+        self.fail = set(fail)
+
+    def _chat(self, messages, functions=None, function_call=None, **kwargs):
+        number = int(re.search(r"Transfer (\d+) mL", messages[-1]["content"]).group(1))
+        if number in self.fail:
+            raise RuntimeError(f"worker failure {number}")
+        response = super()._chat(messages, functions, function_call, **kwargs)
+        function_call = response["choices"][0]["message"]["function_call"]
+        arguments = json.loads(function_call["arguments"])
+        arguments["volume"] = number
+        function_call["arguments"] = json.dumps(arguments)
+        return response
+
+
+def volumes(codes):
+    return [int(float(re.search(r"volume=([\d.]+)", code).group(1))) for code in codes]
+
+
+@pytest.mark.parametrize("concurrency", [1, 4, 12])
+def test_codes_are_emitted_in_input_order(nlp, concurrency):
+    sink = CollectSink()
+    results = convert(PROCEDURE, sink, concurrency=concurrency, client=EchoClient(jitter=0.02), fast_path=False)
+
+    assert volumes(sink.code) == list(range(1, 13))
+    assert [action for action, _ in results] == PROCEDURE.splitlines()
+    assert sink.errors == []
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_worker_errors_are_reported_in_place(nlp, concurrency):
+    sink = CollectSink()
+    results = convert(PROCEDURE, sink, concurrency=concurrency, client=EchoClient(fail={3, 8}, jitter=0.02), fast_path=False)
+
+    assert volumes(sink.code) == [number for number in range(1, 13) if number not in (3, 8)]
+    assert [error["error"] for error in sink.errors] == ["worker failure 3", "worker failure 8"]
+    assert [code is None for _, code in results] == [number in (3, 8) for number in range(1, 13)]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("schema_top_k", [None, 3])
+def test_every_action_is_matched_once(nlp, monkeypatch, stream, schema_top_k):
+    import generate_chatgpt_func_call
+    import match_function
+
+    matched = []
+    original = match_function.match_many
+    monkeypatch.setattr(generate_chatgpt_func_call, "match_many",
+                        lambda instructions, *args, **kwargs: matched.extend(instructions) or original(instructions, *args, **kwargs))
+    monkeypatch.setattr(generate_chatgpt_func_call, "match_to_function",
+                        lambda instruction, functions: pytest.fail(f"{instruction!r} matched again"))
+
+    sink = CollectSink()
+    convert(PROCEDURE, sink, concurrency=4, client=EchoClient(), fast_path=False, stream=stream, schema_top_k=schema_top_k)
+
+    assert sorted(matched) == sorted(PROCEDURE.splitlines())
+    assert volumes(sink.code) == list(range(1, 13))
+
+
+class CompactSink:
+    compact = True
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data=None, **kwargs):
+        self.events.append((event, data))
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_compact_emitters_get_no_free_text(nlp, stream):
+    sink = CompactSink()
+    convert(PROCEDURE, sink, concurrency=4, client=EchoClient(fail={3}), fast_path=False, stream=stream)
+
+    # Streamed partial code is still previewed, everything else is one payload per action
+    results = [data for event, data in sink.events if event != "partial_structured"]
+    assert {event for event, _ in sink.events} <= {"action_result", "partial_structured"}
+    assert [result["action"] for result in results] == PROCEDURE.splitlines()
+    assert [result["error"] is not None for result in results] == [number == 3 for number in range(1, 13)]
+
+    # A resubmission reuses the unchanged lines and translates the edited one
+    translations = IncrementalTranslator()
+    translations.translate("session", PROCEDURE, CompactSink(), client=EchoClient(), fast_path=False, stream=stream)
+    sink = CompactSink()
+    translations.translate("session", PROCEDURE.replace("Transfer 5 mL", "Transfer 50 mL"), sink, concurrency=4,
+                           client=EchoClient(), fast_path=False, stream=stream)
+
+    assert {event for event, _ in sink.events} <= {"output_layout", "action_result", "partial_structured"}
+    assert [result["action"] for event, result in sink.events if event == "action_result"] == \
+        ["Transfer 50 mL of THF from thf to rxn_well with needle 1."]
+
+
+class CancellingClient(EchoClient):
+    """Stub cancelling the conversion while translating action 2, and answering action 1 after that."""
+
+    def __init__(self, cancel, **kwargs):
+        super().__init__(**kwargs)
+        self.cancel = cancel
+
+    def _chat(self, messages, functions=None, function_call=None, **kwargs):
+        number = int(re.search(r"Transfer (\d+) mL", messages[-1]["content"]).group(1))
+        if number == 1:
+            time.sleep(0.3)
+        elif number == 2:
+            time.sleep(0.1)
+            self.cancel.set()
+        return super()._chat(messages, functions, function_call, **kwargs)
+
+
+def test_nothing_is_emitted_once_cancelled(nlp):
+    cancel = Event()
+    sink = CollectSink()
+    convert(PROCEDURE, sink, concurrency=4, client=CancellingClient(cancel), fast_path=False, cancel=cancel)
+
+    # Action 1 was translated after the cancellation and is dropped with the rest
+    assert sink.code == [] and sink.errors == []
+
+
+def batch_message(calls):
+    return {"role": "assistant", "content": None,
+            "function_call": {"name": BATCH_FUNCTION, "arguments": json.dumps({"calls": calls})}}
+
+
+def test_batch_is_split_by_step():
+    calls = [
+        {"step": 2, "name": "stir", "arguments": {"speed": 600}},
+        {"step": 1, "name": "wait", "arguments": '{"minutes": 5}'},
+        {"step": 3, "name": "filter", "arguments": {}},
+        {"step": 3, "name": "dry", "arguments": {}},
+        {"step": 5, "name": "heat", "arguments": {}},
+        {"step": "4", "name": "heat", "arguments": {}},
+    ]
+
+    # Step 3 is answered twice, step 4 is missing and step 5 is out of range
+    assert parse_batch(batch_message(calls), 4) == [("wait", {"minutes": 5}), ("stir", {"speed": 600}), None, None]
+    assert parse_batch({"role": "assistant", "content": "Sorry"}, 2) == [None, None]
+    assert parse_batch({"function_call": {"name": BATCH_FUNCTION, "arguments": "{calls"}}, 2) == [None, None]
+
+
+class BatchClient(EchoClient):
+    """Stub answering batches with an invalid call for step 2 and no call for step 4."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.retried = []
+
+    def _chat(self, messages, functions=None, function_call=None, **kwargs):
+        if function_call["name"] != BATCH_FUNCTION:
+            self.retried.append(int(re.search(r"Transfer (\d+) mL", messages[-1]["content"]).group(1)))
+            return super()._chat(messages, functions, function_call, **kwargs)
+        response = StubClient._chat(self, messages, functions, function_call, **kwargs)
+        batch_call = response["choices"][0]["message"]["function_call"]
+        calls = json.loads(batch_call["arguments"])["calls"]
+        numbers = [int(number) for number in re.findall(r"^\d+\. Transfer (\d+) mL", messages[-1]["content"], re.MULTILINE)]
+        self.batches.append(numbers)
+        for call in calls:
+            call["arguments"]["volume"] = numbers[call["step"] - 1]
+        calls[1]["arguments"]["volume"] = "two"
+        del calls[3]
+        batch_call["arguments"] = json.dumps({"calls": calls})
+        return response
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_invalid_and_missing_batch_steps_are_retried_alone(nlp, concurrency):
+    client = BatchClient()
+    sink = CollectSink()
+    results = convert(PROCEDURE, sink, concurrency=concurrency, client=client, fast_path=False, batch_size=6)
+
+    assert sorted(client.batches) == [list(range(1, 7)), list(range(7, 13))]
+    # Step 2 and 4 of each batch
+    assert sorted(client.retried) == [2, 4, 8, 10]
+    assert volumes(sink.code) == list(range(1, 13))
+    assert [action for action, _ in results] == PROCEDURE.splitlines()
+    assert sink.errors == []
@@ -0,0 +1,50 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from function_registry import DEFAULT_CATALOG_PATH, FunctionRegistry
+
+
+@pytest.fixture
+def catalog_path(tmp_path):
+    path = tmp_path / "functions.json"
+    shutil.copy(DEFAULT_CATALOG_PATH, path)
+    return path
+
+
+def touch(path, offset):
+    # Make sure the change is seen even on file systems with coarse timestamps
+    mtime = os.stat(path).st_mtime + offset
+    os.utime(path, (mtime, mtime))
+
+
+def test_missing_file_keeps_the_previous_catalog(catalog_path):
+    registry = FunctionRegistry(str(catalog_path), check_interval=0)
+    functions = registry.functions
+    os.remove(catalog_path)
+    assert registry.functions is functions
+    assert registry.reload_if_changed() is False
+
+
+def test_invalid_file_keeps_the_previous_catalog(catalog_path, caplog):
+    registry = FunctionRegistry(str(catalog_path), check_interval=0)
+    functions = registry.functions
+    catalog_path.write_text("{not json")
+    touch(catalog_path, 10)
+    assert registry.functions is functions
+    assert [record.levelname for record in caplog.records] == ["WARNING"]
+    assert "Could not reload the function catalog" in caplog.records[0].getMessage()
+    catalog_path.write_text(json.dumps({"functions": [{"name": "broken"}]}))
+    touch(catalog_path, 20)
+    assert registry.functions is functions
+
+
+def test_changed_file_is_reloaded(catalog_path):
+    registry = FunctionRegistry(str(catalog_path), check_interval=0)
+    data = json.loads(catalog_path.read_text())
+    data["functions"] = data["functions"][:2]
+    catalog_path.write_text(json.dumps(data))
+    touch(catalog_path, 10)
+    assert [func["name"] for func in registry.functions] == [func["name"] for func in data["functions"]]
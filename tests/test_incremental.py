@@ -0,0 +1,96 @@
+from threading import Event
+
+from incremental import Block, IncrementalTranslator, plan, split_blocks
+from stub_client import StubClient
+
+LINES = ["Stir rxn_well.", "Wait 5 min.", "Filter rxn_well.", "Dry the filtrate."]
+
+
+def blocks_of(lines):
+    return split_blocks(lines, [(line, f"code({line!r})") for line in lines])
+
+
+def test_split_one_block_per_line():
+    blocks = blocks_of(LINES[:2])
+
+    assert blocks == [Block(("Stir rxn_well.",), ["Stir rxn_well."], ["code('Stir rxn_well.')"]),
+                      Block(("Wait 5 min.",), ["Wait 5 min."], ["code('Wait 5 min.')"])]
+    assert split_blocks([], []) == []
+
+
+def test_split_lines_with_several_actions_into_one_block():
+    results = [("Stir rxn_well.", "stir()"), ("Heat rxn_well.", "heat()"), ("Wait 5 min.", "wait()")]
+
+    assert split_blocks(["Stir and heat rxn_well.", "Wait 5 min."], results) == [
+        Block(("Stir and heat rxn_well.", "Wait 5 min."), ["Stir rxn_well.", "Heat rxn_well.", "Wait 5 min."],
+              ["stir()", "heat()", "wait()"]),
+    ]
+
+
+def test_plan_reuses_unchanged_lines():
+    blocks = blocks_of(LINES)
+
+    assert plan(blocks, LINES) == blocks
+    assert plan([], LINES) == [LINES]
+
+
+def test_plan_translates_inserted_and_changed_lines():
+    blocks = blocks_of(LINES)
+    lines = ["Stir rxn_well.", "Add 2 mL of THF.", "Wait 5 min.", "Filter rxn_well twice.", "Dry the filtrate."]
+
+    assert plan(blocks, lines) == [blocks[0], ["Add 2 mL of THF."], blocks[1], ["Filter rxn_well twice."], blocks[3]]
+
+
+def test_plan_follows_reordered_lines():
+    blocks = blocks_of(LINES)
+    lines = [LINES[3], LINES[0], LINES[1], LINES[2]]
+
+    assert plan(blocks, lines) == [[LINES[3]], blocks[0], blocks[1], blocks[2]]
+
+
+def test_plan_retranslates_failed_blocks():
+    blocks = blocks_of(LINES)
+    blocks[1] = Block(blocks[1].lines, blocks[1].actions, [None])
+
+    assert plan(blocks, LINES) == [blocks[0], [LINES[1]], blocks[2], blocks[3]]
+
+
+def test_plan_reuses_multi_action_blocks_only_as_a_whole():
+    block = Block(tuple(LINES[:2]), ["Stir rxn_well.", "Heat rxn_well.", "Wait 5 min."], ["stir()", "heat()", "wait()"])
+
+    assert plan([block], ["Add THF."] + LINES[:2]) == [["Add THF."], block]
+    assert plan([block], [LINES[0], "Wait 10 min."]) == [[LINES[0], "Wait 10 min."]]
+    assert plan([block], [LINES[1], LINES[0]]) == [[LINES[1], LINES[0]]]
+
+
+class RecordingEmitter:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data=None):
+        self.events.append(event)
+
+
+class CancellingClient(StubClient):
+    """Stub cancelling the job while it segments the changed lines."""
+
+    def __init__(self, cancel):
+        super().__init__()
+        self.cancel = cancel
+
+    def _complete(self, prompt, **kwargs):
+        self.cancel.set()
+        return super()._complete(prompt, **kwargs)
+
+
+def test_cancelled_update_sends_no_layout():
+    translations = IncrementalTranslator()
+    translations.records["session"] = blocks_of(LINES)
+    cancel = Event()
+    emitter = RecordingEmitter()
+
+    translations.translate("session", "\n".join(LINES + ["Weigh the product."]), emitter, cancel,
+                           client=CancellingClient(cancel))
+
+    assert "output_layout" not in emitter.events
+    assert translations.records["session"] == blocks_of(LINES)
@@ -0,0 +1,51 @@
+from threading import Event
+
+from job_manager import JobManager, RoomEmitter
+
+
+class RecordingSocketIO:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data=None, to=None):
+        self.events.append((event, data, to))
+
+
+def test_room_emitter_only_sends_job_status_once_cancelled():
+    socketio = RecordingSocketIO()
+    cancel = Event()
+    emitter = RoomEmitter(socketio, "session", 1, cancel=cancel)
+
+    emitter.emit("correct_structured", "chemspd.stir()")
+    cancel.set()
+    emitter.emit("correct_structured", "chemspd.wait()")
+    emitter.emit("action_result", {"action": "Wait.", "code": "chemspd.wait()", "error": None})
+    emitter.emit("job_status", {"job": 1, "status": "cancelled"})
+
+    assert socketio.events == [
+        ("correct_structured", "chemspd.stir()", "session"),
+        ("job_progress", {"job": 1, "completed": 1}, "session"),
+        ("job_status", {"job": 1, "status": "cancelled"}, "session"),
+    ]
+
+
+def test_cancelled_job_output_is_dropped():
+    socketio = RecordingSocketIO()
+    started = Event()
+
+    def run(input, emitter, cancel):
+        started.set()
+        cancel.wait(5)
+        # Late output of the translation still in flight when the job was cancelled
+        emitter.emit("correct_structured", input)
+
+    jobs = JobManager(socketio, run, max_workers=1)
+    job = jobs.submit("session", "chemspd.stir()")
+    started.wait(5)
+    jobs.cancel(job.id, room="session")
+    job.future.result(5)
+    jobs.shutdown()
+
+    assert [(event, data["status"]) for event, data, _ in socketio.events] == [
+        ("job_status", "queued"), ("job_status", "running"), ("job_status", "cancelled"),
+    ]
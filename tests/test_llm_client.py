@@ -0,0 +1,146 @@
+import time
+
+import openai.error
+import pytest
+
+from llm_client import AdaptiveLimit, ResilientClient, TokenBucket, parse_token_budgets
+from stub_client import StubClient
+
+REQUEST = dict(model="text-davinci-003", prompt='Split "Stir rxn_well."')
+
+
+class RateLimitedClient(StubClient):
+    """Stub answering the first ``failures`` requests with a 429 asking to retry after ``retry_after`` seconds."""
+
+    def __init__(self, failures=1, retry_after=0.3):
+        super().__init__()
+        self.failures = failures
+        self.retry_after = retry_after
+        self.sent = []
+
+    def _complete(self, prompt, **kwargs):
+        self.sent.append(time.monotonic())
+        if len(self.sent) <= self.failures:
+            raise openai.error.RateLimitError("Rate limit reached", http_status=429,
+                                              headers={"Retry-After": str(self.retry_after)})
+        return super()._complete(prompt, **kwargs)
+
+
+def test_rate_limit_is_retried_after_the_requested_delay():
+    stub = RateLimitedClient(failures=1, retry_after=0.3)
+    client = ResilientClient(stub, backoff=0.01, hedge=False)
+
+    response = client.Completion.create(**REQUEST)
+
+    assert response["choices"][0]["text"] == "\nStir rxn_well."
+    assert len(stub.sent) == 2
+    assert stub.sent[1] - stub.sent[0] >= 0.3
+    assert client.limit.in_flight == 0
+
+
+def test_rate_limit_is_raised_once_retries_are_exhausted():
+    stub = RateLimitedClient(failures=3, retry_after=0)
+    client = ResilientClient(stub, max_retries=2, backoff=0.001, hedge=False)
+
+    with pytest.raises(openai.error.RateLimitError):
+        client.Completion.create(**REQUEST)
+    assert len(stub.sent) == 3
+    assert client.limit.in_flight == 0
+
+
+class SlowClient(StubClient):
+    """Stub taking ``delays[n]`` seconds to answer its n-th request, none once they run out."""
+
+    def __init__(self, delays=()):
+        super().__init__()
+        self.delays = list(delays)
+
+    def _complete(self, prompt, **kwargs):
+        with self._lock:
+            delay = self.delays.pop(0) if self.delays else 0
+        time.sleep(delay)
+        return super()._complete(prompt, **kwargs)
+
+
+def test_slow_request_is_hedged():
+    stub = SlowClient([0.005] * 20 + [2.0])
+    client = ResilientClient(stub, hedge=True)
+    for _ in range(20):
+        client.Completion.create(**REQUEST)
+
+    start = time.monotonic()
+    response = client.Completion.create(**REQUEST)
+
+    # The second request answered while the first one was still pending
+    assert time.monotonic() - start < 1.0
+    assert response["choices"][0]["text"] == "\nStir rxn_well."
+    assert stub.calls == 22
+
+
+def test_requests_are_hedged_on_the_latencies_of_their_model():
+    stub = SlowClient([0.005] * 20 + [0.3])
+    client = ResilientClient(stub, hedge=True)
+    for _ in range(20):
+        client.Completion.create(**REQUEST)
+
+    # The latencies of the other model do not make its first, slower requests look late
+    client.Completion.create(**{**REQUEST, "model": "gpt-3.5-turbo-instruct"})
+
+    assert stub.calls == 21
+    assert client.hedge_delay(("completion", "gpt-3.5-turbo-instruct")) is None
+    assert client.hedge_delay(("completion", "text-davinci-003")) is not None
+
+
+def test_limit_halves_on_rate_limit_and_recovers_on_success():
+    limit = AdaptiveLimit(initial=8, minimum=1, maximum=8, cooldown=60)
+
+    limit.on_rate_limit()
+    assert limit.limit == 4
+    # Within the cooldown further 429s belong to the same burst
+    limit.on_rate_limit()
+    assert limit.limit == 4
+
+    successes = 0
+    while limit.limit < 8:
+        limit.on_success()
+        successes += 1
+    assert limit.limit == 8
+    # Additive increase: about one per round of ``limit`` requests
+    assert 4 * 4 <= successes <= 8 * 4
+
+
+def test_limit_blocks_beyond_the_concurrency():
+    limit = AdaptiveLimit(initial=2)
+
+    assert limit.acquire(block=False) and limit.acquire(block=False)
+    assert not limit.acquire(block=False)
+    limit.release()
+    assert limit.acquire(block=False)
+
+
+def test_stream_holds_its_slot_until_consumed():
+    client = ResilientClient(StubClient(chunk_size=4), hedge=False)
+
+    chunks = client.Completion.create(stream=True, **REQUEST)
+    assert client.limit.in_flight == 1
+    assert "".join(chunk["choices"][0]["text"] for chunk in chunks) == "\nStir rxn_well."
+    assert client.limit.in_flight == 0
+
+    chunks = client.Completion.create(stream=True, **REQUEST)
+    next(chunks)
+    assert client.limit.in_flight == 1
+    chunks.close()
+    assert client.limit.in_flight == 0
+    assert list(chunks) == []
+
+
+@pytest.mark.parametrize("tokens_per_minute", [0, -1])
+def test_token_budget_must_be_positive(tokens_per_minute):
+    with pytest.raises(ValueError):
+        TokenBucket(tokens_per_minute)
+    with pytest.raises(ValueError):
+        parse_token_budgets(f"gpt-4=90000,gpt-3.5-turbo={tokens_per_minute}")
+
+
+def test_token_budgets():
+    assert parse_token_budgets(" gpt-4=90000, text-davinci-003=1e5,") == {"gpt-4": 90000, "text-davinci-003": 100000}
@@ -0,0 +1,121 @@
+import json
+import time
+
+import pytest
+
+from response_cache import CachedClient, ResponseCache, valid_response
+from stub_client import StubClient
+
+SCHEMA = {
+    "name": "transfer_liquid",
+    "description": "Executes a liquid transfer from the source to the target zone.",
+    "parameters": {
+        "type": "object",
+        "properties": {"source": {"type": "string"}, "volume": {"type": "number"}},
+        "required": ["source", "volume"],
+    },
+}
+
+
+def chat_request(content="Transfer 1 mL from thf", **kwargs):
+    return dict(model="gpt-4", messages=[{"role": "user", "content": content}], functions=[SCHEMA],
+                function_call={"name": "transfer_liquid"}, **kwargs)
+
+
+class InvalidClient(StubClient):
+    """Stub answering with a call missing the required volume."""
+
+    def _chat(self, messages, functions=None, function_call=None, **kwargs):
+        response = super()._chat(messages, functions, function_call, **kwargs)
+        response["choices"][0]["message"]["function_call"]["arguments"] = json.dumps({"source": "thf"})
+        return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def test_hit_and_miss(cache):
+    assert cache.get("key") is None
+    cache.set("key", {"answer": 42})
+    assert cache.get("key") == {"answer": 42}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl=0.05)
+    cache.set("key", 1)
+    assert cache.get("key") == 1
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_bytes=2 * len(json.dumps("x" * 100)))
+    cache.set("a", "x" * 100)
+    time.sleep(0.01)
+    cache.set("b", "x" * 100)
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("c", "x" * 100)
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_completion_is_served_from_the_cache(cache):
+    stub = StubClient()
+    client = CachedClient(stub, cache)
+    first = client.ChatCompletion.create(**chat_request())
+    second = client.ChatCompletion.create(**chat_request(request_timeout=5))
+    assert stub.calls == 1
+    assert second.to_dict_recursive() == first.to_dict_recursive()
+    client.ChatCompletion.create(**chat_request("Transfer 2 mL from thf"))
+    assert stub.calls == 2
+
+
+def test_stream_is_recorded_and_replayed(cache):
+    stub = StubClient()
+    client = CachedClient(stub, cache)
+    recorded = list(client.ChatCompletion.create(stream=True, **chat_request()))
+    replayed = list(client.ChatCompletion.create(stream=True, **chat_request()))
+    assert stub.calls == 1
+    arguments = "".join(chunk["choices"][0]["delta"].get("function_call", {}).get("arguments", "") for chunk in recorded)
+    assert len(replayed) == 1
+    assert replayed[0]["choices"][0]["delta"]["function_call"]["arguments"] == arguments
+
+
+def test_partially_consumed_stream_is_not_cached(cache):
+    client = CachedClient(StubClient(), cache)
+    next(iter(client.ChatCompletion.create(stream=True, **chat_request())))
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_invalid_calls_are_not_cached(cache, stream):
+    stub = InvalidClient()
+    client = CachedClient(stub, cache)
+    for _ in range(2):
+        response = client.ChatCompletion.create(stream=stream, **chat_request())
+        if stream:
+            list(response)
+    assert stub.calls == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_batched_calls_are_validated_step_by_step():
+    batch = {"name": "translate_steps", "parameters": {"type": "object", "properties": {"calls": {"type": "array"}}}}
+    request = {"functions": [SCHEMA, batch]}
+
+    def response(*calls):
+        arguments = json.dumps({"calls": [{"step": step, "name": "transfer_liquid", "arguments": args} for step, args in enumerate(calls, 1)]})
+        return {"choices": [{"message": {"function_call": {"name": "translate_steps", "arguments": arguments}}}]}
+
+    assert valid_response("chat_completion", request, response({"source": "thf", "volume": "3"}))
+    assert not valid_response("chat_completion", request, response({"source": "thf", "volume": 3}, {"source": "thf"}))
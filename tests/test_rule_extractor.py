@@ -0,0 +1,31 @@
+import pytest
+
+from function_registry import get_registry
+from rule_extractor import extract_arguments
+
+
+def schema(name):
+    return get_registry().catalog.by_name[name]
+
+
+@pytest.mark.parametrize("action, function, expected", [
+    ("Transfer 10 mL of THF (liquid) from thf to internal_standard with needle 1.", "transfer_liquid",
+     {"source": "thf", "destination": "internal_standard", "volume": 10, "needle": 1}),
+    ("Transfer 0.1 mg of base (solid) from base to rxn_well.", "transfer_solid",
+     {"source": "base", "destination": "rxn_well", "weight": 0.1}),
+])
+def test_templated_actions_are_extracted(nlp, action, function, expected):
+    assert extract_arguments(action, schema(function)) == expected
+
+
+@pytest.mark.parametrize("action, function", [
+    ("Transfer half of the 10 mL of THF from thf to rxn_well with needle 1.", "transfer_liquid"),
+    ("Do not transfer 5 mL of THF from thf to rxn_well with needle 1.", "transfer_liquid"),
+    ("Don't transfer 5 mL of THF from thf to rxn_well with needle 1.", "transfer_liquid"),
+    ("Transfer 5 mL of THF from thf to rxn_well with needle 2 twice.", "transfer_liquid"),
+    ("Transfer 5 mL of THF from thf to each well with needle 1.", "transfer_liquid"),
+    ("Perform 3 Schlenk cycles on rxn_well.", "do_schlenk_cycles"),
+    ("Transfer 5 mL of THF from thf to rxn_well with needle 1 and 2 mL to vial_2.", "transfer_liquid"),
+])
+def test_ambiguous_actions_are_left_to_the_llm(nlp, action, function):
+    assert extract_arguments(action, schema(function)) is None
@@ -0,0 +1,55 @@
+from queue import Empty, Queue
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def webserver():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # No response cache file and no background warm-up for the module imported by the tests
+        monkeypatch.setenv("RESPONSE_CACHE_PATH", "")
+        monkeypatch.setenv("WARM_UP", "0")
+        return pytest.importorskip("flask_webserver")
+
+
+@pytest.fixture
+def local_apps(webserver):
+    """Two apps sharing their Socket.IO sessions through ``local://``."""
+    apps = [webserver.create_app("threading", message_queue="local://") for _ in range(2)]
+    yield apps
+    for app in apps:
+        app.extensions["socketio"].server.manager.close()
+
+
+def listen(app, monkeypatch):
+    """Connect a session to the Socket.IO server of ``app``; returns its sid and the queue of its events."""
+    server = app.extensions["socketio"].server
+    # Starts the manager, and with it the thread listening to the message queue
+    server._handle_eio_connect("eio-session", {})
+    sid = server.manager.connect("eio-session", "/")
+    received = Queue()
+    monkeypatch.setattr(server, "_emit_internal",
+                        lambda eio_sid, event, data, namespace=None, id=None: received.put((eio_sid, event, data)))
+    return sid, received
+
+
+def test_apps_have_their_own_state(webserver):
+    first = webserver.create_app("threading")
+    second = webserver.create_app("threading")
+
+    for name in ["socketio", "translation_jobs", "translations"]:
+        assert first.extensions[name] is not second.extensions[name]
+    assert first.extensions["translation_jobs"].socketio is first.extensions["socketio"]
+    assert "translate" in first.extensions["socketio"].server.handlers["/"]
+
+
+def test_emit_reaches_the_other_app_through_local_manager(local_apps, monkeypatch):
+    first, second = local_apps
+    sid, received = listen(second, monkeypatch)
+
+    first.extensions["socketio"].emit("job_status", {"job": 1, "status": "done"}, to=sid)
+
+    assert received.get(timeout=5) == ("eio-session", "job_status", {"job": 1, "status": "done"})
+    first.extensions["socketio"].emit("job_status", {"job": 2, "status": "done"}, to="other-session")
+    with pytest.raises(Empty):
+        received.get(timeout=0.2)
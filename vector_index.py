@@ -0,0 +1,111 @@
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".vector_cache")
+
+# Embedding rows compared with the queries at once
+BLOCK_SIZE = 8192
+
+
+def normalize(matrix):
+    """L2-normalize the rows of ``matrix``; zero rows stay zero."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+@lru_cache(maxsize=None)
+def _load_vectors(model):
+    import spacy
+
+    # Only the tokenizer and the static vectors of the vocabulary are used
+    return spacy.load(model, exclude=["tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"])
+
+
+class SpacyEmbedder:
+    """Sentence embeddings averaging the static word vectors of a local spaCy model.
+
+    Needs a model shipping word vectors such as ``en_core_web_md``. Any
+    object with a ``name`` and an ``embed(texts)`` method returning one row
+    per text can be used instead, e.g. a small local sentence encoder.
+    """
+
+    def __init__(self, model="en_core_web_md"):
+        self.name = model
+
+    def embed(self, texts):
+        nlp = _load_vectors(self.name)
+        if not nlp.vocab.vectors.shape[1]:
+            raise ValueError(f"The spaCy model {self.name!r} has no word vectors")
+        return np.array([nlp.make_doc(text).vector for text in texts], dtype=np.float32)
+
+
+def function_texts(functions):
+    """Texts embedded for every function and the index of the function of each text.
+
+    Every function is represented by its name as words and by its
+    description; a function scores the best similarity of its texts.
+    """
+    texts, owners = [], []
+    for position, func in enumerate(functions):
+        for text in (func["name"].replace("_", " "), func["description"]):
+            texts.append(text)
+            owners.append(position)
+    return texts, np.array(owners, dtype=np.int64)
+
+
+class VectorIndex:
+    """Normalized embedding matrix of the function texts, memory-mapped from disk.
+
+    The matrix is stored in ``cache_dir`` under a hash of the embedder name
+    and the texts, so it is computed once per catalog version and shared
+    by every process that memory-maps it.
+    """
+
+    def __init__(self, embedder, matrix, owners, size):
+        self.embedder = embedder
+        self.matrix = matrix
+        self.owners = owners
+        self.size = size
+        # First row of every run of rows belonging to the same function
+        self._starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+
+    @classmethod
+    def build(cls, functions, embedder, cache_dir=DEFAULT_CACHE_DIR):
+        texts, owners = function_texts(functions)
+        digest = hashlib.sha256("\0".join([embedder.name, *texts]).encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"{digest}.npy")
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            matrix = normalize(embedder.embed(texts))
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                np.save(f, matrix)
+            os.replace(temporary, path)
+        return cls(embedder, np.load(path, mmap_mode="r"), owners, len(functions))
+
+    def embed(self, texts):
+        return normalize(self.embedder.embed(texts))
+
+    def score_matrix(self, texts):
+        """Texts x functions matrix of the best cosine similarity of each function.
+
+        The embedding matrix is scanned in blocks of ``BLOCK_SIZE`` rows so
+        only one block of scores is in memory at a time.
+        """
+        queries = self.embed(texts)
+        scores = np.full((len(texts), self.size), -1.0, dtype=np.float32)
+        for start in range(0, len(self.matrix), BLOCK_SIZE):
+            stop = min(start + BLOCK_SIZE, len(self.matrix))
+            block_scores = queries @ np.asarray(self.matrix[start:stop]).T
+            starts = self._starts[(self._starts >= start) & (self._starts < stop)]
+            if not len(starts) or starts[0] != start:
+                # The block begins in the middle of the rows of a function
+                starts = np.r_[start, starts]
+            pooled = np.maximum.reduceat(block_scores, starts - start, axis=1)
+            owners = self.owners[starts]
+            scores[:, owners] = np.maximum(scores[:, owners], pooled)
+        return scores